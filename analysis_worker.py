@@ -0,0 +1,87 @@
+"""
+Пул процессов для фоновой обработки видео
+Выносит тяжелую CPU-работу (декодирование, трекинг, кодирование PNG) из процесса API
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+
+from store_zone_analyzer import (
+    process_video,
+    calculate_statistics,
+    create_visualization,
+    get_model,
+    get_detection_model
+)
+
+# ============================================================================
+# КОНФИГУРАЦИЯ
+# ============================================================================
+
+# Количество процессов-обработчиков (одновременно анализируемых видео)
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "2"))
+
+# Степень сжатия PNG визуализации (0-9): 1 кодируется в разы быстрее уровня по умолчанию (3)
+# ценой немного большего файла, который к тому же кэшируется клиентом по ETag
+VISUALIZATION_PNG_COMPRESSION = 1
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Возвращает общий пул процессов, создавая его при первом обращении."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS, initializer=warm_up_worker)
+    return _executor
+
+
+def warm_up_worker():
+    """Загружает модели при старте процесса-обработчика, а не при первой задаче."""
+    get_model()
+    get_detection_model()
+
+
+def shutdown_executor():
+    """Останавливает пул процессов (вызывается при остановке API)."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def run_analysis(video_path: str, zones: Dict[str, List[Tuple[int, int]]], result_image_path: str) -> Dict[str, Dict]:
+    """
+    Выполняет полный анализ видео в процессе-обработчике.
+
+    Args:
+        video_path: путь к видеофайлу
+        zones: зоны во внутреннем формате
+        result_image_path: куда сохранить визуализацию
+
+    Returns:
+        {zone_name: {"zone_name": str, "total_time": float, "avg_time": float, "visitor_count": int}}
+    """
+    # Зоны передаются явно: глобальное состояние анализатора не меняется
+    zone_statistics, last_frame, scale, scaled_zones, track_merges = process_video(video_path, zones=zones)
+
+    # Вычисляем статистику
+    stats = calculate_statistics(zone_statistics, track_merges)
+
+    # Создаем и сохраняем визуализацию
+    visualization = create_visualization(last_frame, stats, zone_statistics, scaled_zones)
+    cv2.imwrite(result_image_path, visualization, [cv2.IMWRITE_PNG_COMPRESSION, VISUALIZATION_PNG_COMPRESSION])
+
+    # Возвращаем только простые типы: результат передается между процессами
+    return {
+        zone_name: {
+            "zone_name": zone_name,
+            "total_time": float(data["total_time"]),
+            "avg_time": float(data["avg_time"]),
+            "visitor_count": int(data["visitor_count"])
+        }
+        for zone_name, data in stats.items()
+    }
@@ -3,29 +3,31 @@ FastAPI приложение для анализа зон магазина
 Предоставляет REST API для загрузки видео, настройки зон и получения статистики
 """
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
+from fastapi.responses import FileResponse, ORJSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 import os
+import asyncio
 import json
 import uuid
+import hashlib
+import base64
+from functools import lru_cache
 import cv2
 import numpy as np
 from pathlib import Path
 import tempfile
-import shutil
+import aiofiles
 from datetime import datetime
 from enum import Enum
 
-from store_zone_analyzer import (
-    process_video,
-    calculate_statistics,
-    create_visualization,
-    load_zones_from_json,
-    ZONES_FILE
-)
+from store_zone_analyzer import load_zones_from_json, ZONES_FILE
+from analysis_worker import get_executor, shutdown_executor, run_analysis
+from task_storage import TaskStorage, TASKS_DB_PATH
 
 # ============================================================================
 # КОНФИГУРАЦИЯ
@@ -36,11 +38,65 @@ RESULTS_DIR = Path("results")
 UPLOAD_DIR.mkdir(exist_ok=True)
 RESULTS_DIR.mkdir(exist_ok=True)
 
-# Глобальное хранилище задач
-tasks_storage: Dict[str, Dict] = {}
+# Незавершенные загрузки по частям: подкаталог UPLOAD_DIR, index_existing_videos
+# его пропускает, так как индексирует только файлы
+PARTIAL_UPLOAD_DIR = UPLOAD_DIR / "partial"
+PARTIAL_UPLOAD_DIR.mkdir(exist_ok=True)
+
+# Рядом с файлом загрузки хранится список полученных диапазонов байт ("offset size" на строку)
+PARTIAL_RANGES_SUFFIX = ".ranges"
+
+# Через сколько секунд брошенная загрузка по частям удаляется при старте API
+PARTIAL_UPLOAD_TTL = 24 * 3600
+
+# Поддерживаемые расширения видео
+ALLOWED_VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.flv'}
+
+# Размер блока при потоковой записи загружаемых файлов
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Максимальный размер загружаемого видео (байт), по умолчанию 5 ГБ
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(5 * 1024 ** 3)))
+
+# Сколько байт заголовка нужно для определения контейнера видео
+VIDEO_HEADER_SIZE = 12
+
+# Сколько закодированных первых кадров держать в памяти
+FIRST_FRAME_CACHE_SIZE = 32
+
+# Заголовок Cache-Control для визуализаций: файл привязан к task_id и не меняется после завершения задачи
+VISUALIZATION_CACHE_CONTROL = "private, max-age=31536000, immutable"
 
-# Глобальное хранилище зон (по умолчанию загружаем из файла)
-current_zones: Dict[str, List[Tuple[int, int]]] = load_zones_from_json(ZONES_FILE)
+# Ответы меньше этого размера (байт) не сжимаются gzip
+GZIP_MINIMUM_SIZE = 512
+
+# Типы первого бокса ISO BMFF (mp4/mov)
+ISO_BMFF_BOX_TYPES = {b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot"}
+
+# Хранилище задач в SQLite (общее для всех воркеров Uvicorn)
+tasks_storage = TaskStorage(TASKS_DB_PATH)
+
+# Запущенные корутины анализа (держим ссылки, чтобы их не собрал GC)
+analysis_jobs: Set[asyncio.Task] = set()
+
+# Идентификатор процесса API - владельца задач в хранилище
+WORKER_ID = uuid.uuid4().hex
+
+# Long polling статуса задачи: максимальное ожидание и интервал проверки хранилища (секунды)
+MAX_TASK_WAIT_TIMEOUT = 60.0
+TASK_WAIT_POLL_INTERVAL = 0.5
+
+# Интервал heartbeat и проверки брошенных задач (секунды)
+HEARTBEAT_INTERVAL = 10.0
+
+heartbeat_job: Optional[asyncio.Task] = None
+
+# Текущие зоны: общий источник для всех воркеров Uvicorn - ZONES_FILE.
+# В процессе кэшируется последняя прочитанная версия: (подпись файла, зоны, зоны в API формате).
+# Кэш привязан к подписи файла (inode, mtime, размер), а не к записи в этом процессе:
+# POST /zones в любом воркере атомарно подменяет файл, и остальные перечитывают его при следующем запросе.
+# Все части хранятся одним кортежем, чтобы параллельный запрос не смешал две версии зон
+zones_cache: Optional[Tuple[Optional[Tuple[int, int, int]], Dict[str, List[Tuple[int, int]]], Dict[str, "ZoneCoordinates"]]] = None
 
 # ============================================================================
 # МОДЕЛИ ДАННЫХ
@@ -53,6 +109,10 @@ class ZoneCoordinates(BaseModel):
 class ZonesRequest(BaseModel):
     zones: Dict[str, ZoneCoordinates]
 
+class UploadInitRequest(BaseModel):
+    filename: str
+    size: int
+
 class AnalyzeRequest(BaseModel):
     video_id: str
     zones: Optional[Dict[str, ZoneCoordinates]] = None  # Если не указаны, используются текущие зоны
@@ -77,6 +137,7 @@ class TaskResponse(BaseModel):
     completed_at: Optional[str] = None
     error: Optional[str] = None
     statistics: Optional[Dict[str, StatisticsResponse]] = None
+    visualization_url: Optional[str] = None  # Относительный URL визуализации завершенной задачи
 
 # ============================================================================
 # FASTAPI ПРИЛОЖЕНИЕ
@@ -85,9 +146,31 @@ class TaskResponse(BaseModel):
 app = FastAPI(
     title="Анализатор зон магазина API",
     description="API для анализа видеозаписей и определения времени пребывания посетителей в зонах",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse  # orjson сериализует ответы быстрее стандартного json
 )
 
+class JSONGZipMiddleware:
+    """
+    Сжимает gzip JSON-ответы (статистика, зоны, список задач).
+    
+    Изображения (первый кадр в JPEG, визуализация в PNG) уже сжаты,
+    поэтому их эндпоинты пропускаются без повторного сжатия.
+    """
+    
+    def __init__(self, app, minimum_size: int = GZIP_MINIMUM_SIZE):
+        self.app = app
+        self.gzip_app = GZipMiddleware(app, minimum_size=minimum_size)
+    
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] == "http" and not (path.startswith("/visualization/") or path.endswith("/first-frame")):
+            await self.gzip_app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+app.add_middleware(JSONGZipMiddleware)
+
 # CORS middleware для работы с фронтендом
 app.add_middleware(
     CORSMiddleware,
@@ -97,6 +180,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """Отклоняет слишком большие загрузки по Content-Length до чтения тела запроса."""
+    if request.url.path == "/upload-video":
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+            return ORJSONResponse(
+                status_code=413,
+                content={"detail": f"Файл слишком большой. Максимальный размер: {MAX_UPLOAD_BYTES // 1024 ** 2} МБ"}
+            )
+    return await call_next(request)
+
 # ============================================================================
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 # ============================================================================
@@ -111,6 +206,29 @@ def convert_zones_to_internal_format(zones_dict: Dict[str, ZoneCoordinates]) ->
         ]
     return result
 
+def zones_file_signature() -> Optional[Tuple[int, int, int]]:
+    """Подпись ZONES_FILE (inode, mtime, размер) или None, если файла нет."""
+    try:
+        file_stat = os.stat(ZONES_FILE)
+    except FileNotFoundError:
+        return None
+    return (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size)
+
+def load_current_zones() -> Tuple[Dict[str, List[Tuple[int, int]]], Dict[str, "ZoneCoordinates"]]:
+    """
+    Возвращает текущие зоны во внутреннем и API формате.
+    
+    ZONES_FILE перечитывается, только если его изменил какой-либо воркер.
+    """
+    global zones_cache
+    signature = zones_file_signature()
+    cached = zones_cache
+    if cached is None or cached[0] != signature:
+        zones = load_zones_from_json(ZONES_FILE) if signature is not None else {}
+        cached = (signature, zones, convert_zones_to_api_format(zones))
+        zones_cache = cached
+    return cached[1], cached[2]
+
 def convert_zones_to_api_format(zones_dict: Dict[str, List[Tuple[int, int]]]) -> Dict[str, ZoneCoordinates]:
     """Конвертирует зоны из внутреннего формата в API формат."""
     result = {}
@@ -121,57 +239,239 @@ def convert_zones_to_api_format(zones_dict: Dict[str, List[Tuple[int, int]]]) ->
         )
     return result
 
-def process_video_task(task_id: str, video_path: str, zones: Dict[str, List[Tuple[int, int]]]):
-    """Обрабатывает видео в фоновом режиме."""
+def read_first_frame_jpeg(video_path: str) -> bytes:
+    """Возвращает первый кадр видео в JPEG (из кэша, если файл не менялся)."""
     try:
-        tasks_storage[task_id]["status"] = TaskStatus.PROCESSING
-        
-        # Временно устанавливаем зоны в модуле анализатора
-        import store_zone_analyzer
-        original_zones = store_zone_analyzer.ZONES.copy()
-        store_zone_analyzer.ZONES = zones
-        
-        # Обрабатываем видео
-        zone_statistics, last_frame, scale, scaled_zones, track_merges = process_video(video_path)
-        
-        # Вычисляем статистику
-        stats = calculate_statistics(zone_statistics, track_merges)
-        
-        # Создаем визуализацию
-        visualization = create_visualization(last_frame, stats, zone_statistics, scaled_zones)
+        mtime_ns = os.stat(video_path).st_mtime_ns
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Видео не найдено")
+    return encode_first_frame_jpeg(video_path, mtime_ns)
+
+def first_frame_base64(video_path: str) -> Optional[str]:
+    """Возвращает первый кадр в JPEG, закодированный base64, или None, если кадр не читается."""
+    try:
+        return base64.b64encode(read_first_frame_jpeg(video_path)).decode("ascii")
+    except HTTPException:
+        return None
+
+@lru_cache(maxsize=FIRST_FRAME_CACHE_SIZE)
+def encode_first_frame_jpeg(video_path: str, mtime_ns: int) -> bytes:
+    """Читает первый кадр видео и кодирует его в JPEG (mtime_ns входит в ключ кэша)."""
+    # Явно выбираем FFmpeg, чтобы OpenCV не перебирал бэкенды при открытии
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+    if not cap.isOpened():
+        cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise HTTPException(status_code=400, detail="Не удалось открыть видеофайл")
+    
+    ret, frame = cap.read()
+    cap.release()
+    
+    if not ret:
+        raise HTTPException(status_code=400, detail="Не удалось прочитать первый кадр")
+    
+    # cv2.imencode кодирует BGR напрямую, без конвертации в RGB и PIL
+    ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    if not ok:
+        raise HTTPException(status_code=500, detail="Не удалось закодировать кадр")
+    
+    return buffer.tobytes()
+
+def task_response(task: Dict) -> TaskResponse:
+    """Строит ответ по задаче: у завершенной задачи сразу есть статистика и ссылка на визуализацию."""
+    visualization_url = None
+    if task["status"] == TaskStatus.COMPLETED and task.get("visualization_path"):
+        visualization_url = f"/visualization/{task['task_id']}"
+    return TaskResponse(**task, visualization_url=visualization_url)
+
+def remove_file_if_exists(path) -> None:
+    """Удаляет файл, если он существует."""
+    if os.path.exists(path):
+        os.remove(path)
+
+def video_extension(filename: Optional[str]) -> str:
+    """Возвращает расширение видео или бросает 400, если формат не поддерживается."""
+    if not filename:
+        raise HTTPException(status_code=400, detail="Имя файла не указано")
+    
+    file_ext = Path(filename).suffix.lower()
+    if file_ext not in ALLOWED_VIDEO_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Неподдерживаемый формат файла. Разрешенные: {', '.join(ALLOWED_VIDEO_EXTENSIONS)}"
+        )
+    return file_ext
+
+def find_partial_upload(upload_id: str) -> Path:
+    """Возвращает файл незавершенной загрузки или бросает 404."""
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Загрузка не найдена")
+    
+    for path in PARTIAL_UPLOAD_DIR.glob(f"{upload_id}.*"):
+        if path.suffix != PARTIAL_RANGES_SUFFIX:
+            return path
+    raise HTTPException(status_code=404, detail="Загрузка не найдена")
+
+def partial_ranges_path(partial_path: Path) -> Path:
+    """Путь к файлу с диапазонами, полученными для загрузки по частям."""
+    return partial_path.with_suffix(PARTIAL_RANGES_SUFFIX)
+
+def first_missing_byte(ranges_path: Path, size: int) -> Optional[int]:
+    """
+    Возвращает смещение первого не полученного байта или None, если покрыт весь [0, size).
+    
+    Повторно отправленные части дают пересекающиеся диапазоны, поэтому проверяется
+    покрытие, а не сумма размеров.
+    """
+    try:
+        with open(ranges_path, encoding="ascii") as f:
+            ranges = sorted(tuple(map(int, line.split())) for line in f if line.strip())
+    except FileNotFoundError:
+        ranges = []
+    
+    covered = 0
+    for offset, length in ranges:
+        if offset > covered:
+            break
+        covered = max(covered, offset + length)
+    return None if covered >= size else covered
+
+def remove_stale_partial_uploads() -> None:
+    """Удаляет загрузки по частям, которые так и не были завершены."""
+    expired_before = datetime.now().timestamp() - PARTIAL_UPLOAD_TTL
+    for path in PARTIAL_UPLOAD_DIR.iterdir():
+        if path.is_file() and path.stat().st_mtime < expired_before:
+            remove_file_if_exists(path)
+
+def index_existing_videos() -> None:
+    """Добавляет в индекс видео, загруженные до появления индекса."""
+    for video_file in UPLOAD_DIR.iterdir():
+        if video_file.is_file() and tasks_storage.get_video_path(video_file.stem) is None:
+            tasks_storage.add_video(video_file.stem, str(video_file))
+
+def visualization_etag(path: str, file_stat: os.stat_result) -> str:
+    """Вычисляет ETag визуализации по пути, времени изменения и размеру файла."""
+    key = f"{path}:{file_stat.st_mtime_ns}:{file_stat.st_size}".encode()
+    return f'"{hashlib.blake2b(key, digest_size=8).hexdigest()}"'
+
+def is_video_header(header: bytes) -> bool:
+    """Проверяет по сигнатуре, что заголовок принадлежит поддерживаемому видеоконтейнеру."""
+    if len(header) < VIDEO_HEADER_SIZE:
+        return False
+    
+    # MP4 / MOV (ISO BMFF): тип первого бокса по смещению 4
+    if header[4:8] in ISO_BMFF_BOX_TYPES:
+        return True
+    # AVI: RIFF....AVI
+    if header[:4] == b"RIFF" and header[8:12] == b"AVI ":
+        return True
+    # MKV: заголовок EBML
+    if header[:4] == b"\x1aE\xdf\xa3":
+        return True
+    # FLV
+    if header[:3] == b"FLV":
+        return True
+    
+    return False
+
+async def process_video_task(task_id: str, video_path: str, zones: Dict[str, List[Tuple[int, int]]]):
+    """Обрабатывает видео в пуле процессов, не блокируя процесс API."""
+    try:
+        await run_in_threadpool(tasks_storage.update, task_id, status=TaskStatus.PROCESSING)
         
-        # Сохраняем результат
         result_image_path = RESULTS_DIR / f"{task_id}_visualization.png"
-        cv2.imwrite(str(result_image_path), visualization)
         
-        # Восстанавливаем оригинальные зоны
-        store_zone_analyzer.ZONES = original_zones
+        # Декодирование, трекинг и визуализация выполняются в отдельном процессе
+        loop = asyncio.get_running_loop()
+        statistics = await loop.run_in_executor(
+            get_executor(), run_analysis, video_path, zones, str(result_image_path)
+        )
         
         # Сохраняем результаты в задачу
-        tasks_storage[task_id]["status"] = TaskStatus.COMPLETED
-        tasks_storage[task_id]["completed_at"] = datetime.now().isoformat()
-        tasks_storage[task_id]["statistics"] = {
-            zone_name: {
-                "zone_name": zone_name,
-                "total_time": data["total_time"],
-                "avg_time": data["avg_time"],
-                "visitor_count": data["visitor_count"]
-            }
-            for zone_name, data in stats.items()
-        }
-        tasks_storage[task_id]["visualization_path"] = str(result_image_path)
+        await run_in_threadpool(
+            tasks_storage.update,
+            task_id,
+            status=TaskStatus.COMPLETED,
+            completed_at=datetime.now().isoformat(),
+            statistics=statistics,
+            visualization_path=str(result_image_path)
+        )
         
     except Exception as e:
-        tasks_storage[task_id]["status"] = TaskStatus.FAILED
-        tasks_storage[task_id]["completed_at"] = datetime.now().isoformat()
-        tasks_storage[task_id]["error"] = str(e)
+        await run_in_threadpool(
+            tasks_storage.update,
+            task_id,
+            status=TaskStatus.FAILED,
+            completed_at=datetime.now().isoformat(),
+            error=str(e)
+        )
         import traceback
         traceback.print_exc()
 
+def schedule_analysis(task_id: str, video_path: str, zones: Dict[str, List[Tuple[int, int]]]):
+    """Запускает обработку видео в фоне."""
+    job = asyncio.create_task(process_video_task(task_id, video_path, zones))
+    analysis_jobs.add(job)
+    job.add_done_callback(analysis_jobs.discard)
+
+async def recover_orphaned_tasks():
+    """Перезапускает незавершенные задачи, брошенные остановленными процессами API."""
+    tasks = await run_in_threadpool(
+        tasks_storage.claim_orphaned_tasks, WORKER_ID, (TaskStatus.PENDING, TaskStatus.PROCESSING)
+    )
+    for task in tasks:
+        video_path = None
+        if task["video_id"]:
+            video_path = await run_in_threadpool(tasks_storage.get_video_path, task["video_id"])
+        
+        if video_path is None or task["zones"] is None:
+            await run_in_threadpool(
+                tasks_storage.update,
+                task["task_id"],
+                status=TaskStatus.FAILED,
+                completed_at=datetime.now().isoformat(),
+                error="Обработка прервана перезапуском API, задачу невозможно восстановить"
+            )
+            continue
+        
+        zones = {zone_name: [tuple(point) for point in rect] for zone_name, rect in task["zones"].items()}
+        print(f"Перезапуск прерванной задачи {task['task_id']}")
+        schedule_analysis(task["task_id"], video_path, zones)
+
+async def heartbeat_loop():
+    """Периодически отмечает процесс живым и забирает задачи остановленных процессов."""
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        try:
+            await run_in_threadpool(tasks_storage.heartbeat, WORKER_ID)
+            await recover_orphaned_tasks()
+        except Exception:
+            import traceback
+            traceback.print_exc()
+
 # ============================================================================
 # ЭНДПОИНТЫ
 # ============================================================================
 
+@app.on_event("startup")
+async def startup():
+    """Индексирует загруженные видео и перезапускает задачи, прерванные остановкой API."""
+    global heartbeat_job
+    await run_in_threadpool(index_existing_videos)
+    await run_in_threadpool(remove_stale_partial_uploads)
+    await run_in_threadpool(tasks_storage.heartbeat, WORKER_ID)
+    await recover_orphaned_tasks()
+    heartbeat_job = asyncio.create_task(heartbeat_loop())
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Останавливает heartbeat и пул процессов обработки."""
+    if heartbeat_job is not None:
+        heartbeat_job.cancel()
+    shutdown_executor()
+
 @app.get("/")
 async def root():
     """Корневой эндпоинт с информацией об API."""
@@ -199,48 +499,56 @@ async def upload_video(file: UploadFile = File(...)):
     """
     try:
         # Проверяем расширение файла
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="Имя файла не указано")
-        
-        allowed_extensions = {'.mp4', '.avi', '.mov', '.mkv', '.flv'}
-        file_ext = Path(file.filename).suffix.lower()
-        
-        if file_ext not in allowed_extensions:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Неподдерживаемый формат файла. Разрешенные: {', '.join(allowed_extensions)}"
-            )
+        file_ext = video_extension(file.filename)
         
         # Генерируем уникальный ID для видео
         video_id = str(uuid.uuid4())
         video_path = UPLOAD_DIR / f"{video_id}{file_ext}"
         
-        # Сохраняем файл
+        # Сохраняем файл блоками, не блокируя event loop
+        header = b""
+        written = 0
         try:
-            with open(video_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            async with aiofiles.open(video_path, "wb") as buffer:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    if len(header) < VIDEO_HEADER_SIZE:
+                        header += chunk[:VIDEO_HEADER_SIZE - len(header)]
+                    # Content-Length может отсутствовать (chunked), поэтому считаем и записанное
+                    written += len(chunk)
+                    if written > MAX_UPLOAD_BYTES:
+                        raise HTTPException(
+                            status_code=413,
+                            detail=f"Файл слишком большой. Максимальный размер: {MAX_UPLOAD_BYTES // 1024 ** 2} МБ"
+                        )
+                    await buffer.write(chunk)
+        except HTTPException:
+            await run_in_threadpool(remove_file_if_exists, video_path)
+            raise
         except Exception as e:
-            if video_path.exists():
-                os.remove(video_path)
+            await run_in_threadpool(remove_file_if_exists, video_path)
             raise HTTPException(status_code=500, detail=f"Ошибка сохранения файла: {str(e)}")
         
         # Проверяем размер файла
-        file_size = video_path.stat().st_size
-        if file_size == 0:
-            os.remove(video_path)
+        if not header:
+            await run_in_threadpool(os.remove, video_path)
             raise HTTPException(status_code=400, detail="Загружен пустой файл")
         
-        # Проверяем, что файл действительно видео
-        cap = cv2.VideoCapture(str(video_path))
-        if not cap.isOpened():
-            os.remove(video_path)
+        # Проверяем, что файл действительно видео (по сигнатуре контейнера, без открытия декодера)
+        if not is_video_header(header):
+            await run_in_threadpool(os.remove, video_path)
             raise HTTPException(status_code=400, detail="Не удалось открыть видеофайл. Проверьте формат.")
-        cap.release()
+        
+        # Запоминаем путь, чтобы не искать файл по маске при каждом запросе
+        await run_in_threadpool(tasks_storage.add_video, video_id, str(video_path))
+        
+        # Первый кадр отдаем сразу в ответе: клиенту не нужен отдельный запрос /first-frame
+        first_frame = await run_in_threadpool(first_frame_base64, str(video_path))
         
         return {
             "video_id": video_id,
             "filename": file.filename,
             "path": str(video_path),
+            "first_frame_jpeg": first_frame,
             "message": "Видео успешно загружено"
         }
     except HTTPException:
@@ -250,12 +558,96 @@ async def upload_video(file: UploadFile = File(...)):
         error_detail = f"Неожиданная ошибка: {str(e)}\n{traceback.format_exc()}"
         raise HTTPException(status_code=500, detail=error_detail)
 
+@app.post("/upload-video/init")
+def init_chunked_upload(request: UploadInitRequest):
+    """
+    Начинает загрузку видео по частям.
+    
+    Части отправляются параллельно через PUT /upload-video/{upload_id}/part,
+    после чего загрузка завершается POST /upload-video/{upload_id}/complete.
+    """
+    file_ext = video_extension(request.filename)
+    if request.size <= 0:
+        raise HTTPException(status_code=400, detail="Загружен пустой файл")
+    if request.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Файл слишком большой. Максимальный размер: {MAX_UPLOAD_BYTES // 1024 ** 2} МБ"
+        )
+    
+    upload_id = str(uuid.uuid4())
+    # Файл сразу получает итоговый размер, чтобы части можно было писать по своим смещениям в любом порядке
+    with open(PARTIAL_UPLOAD_DIR / f"{upload_id}{file_ext}", "wb") as f:
+        f.truncate(request.size)
+    
+    return {"upload_id": upload_id, "size": request.size}
+
+@app.put("/upload-video/{upload_id}/part")
+async def upload_video_part(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
+    """Записывает часть видео, переданную телом запроса, по смещению offset."""
+    partial_path = await run_in_threadpool(find_partial_upload, upload_id)
+    size = (await run_in_threadpool(os.stat, partial_path)).st_size
+    
+    written = 0
+    async with aiofiles.open(partial_path, "r+b") as buffer:
+        await buffer.seek(offset)
+        async for chunk in request.stream():
+            written += len(chunk)
+            if offset + written > size:
+                raise HTTPException(status_code=400, detail="Часть выходит за пределы объявленного размера файла")
+            await buffer.write(chunk)
+    
+    # Диапазон записывается только после того, как часть целиком дошла до файла
+    if written:
+        async with aiofiles.open(partial_ranges_path(partial_path), "a", encoding="ascii") as ranges_file:
+            await ranges_file.write(f"{offset} {written}\n")
+    
+    return {"upload_id": upload_id, "offset": offset, "size": written}
+
+@app.post("/upload-video/{upload_id}/complete")
+def complete_chunked_upload(upload_id: str):
+    """
+    Завершает загрузку по частям: проверяет, что получены все части и сигнатуру видео,
+    и переносит файл к загруженным видео.
+    
+    Пока какие-то части не получены, возвращает 400 (загрузку можно продолжить).
+    """
+    partial_path = find_partial_upload(upload_id)
+    ranges_path = partial_ranges_path(partial_path)
+    
+    # Файл создан сразу полного размера, поэтому недошедшие части остались бы нулями
+    missing = first_missing_byte(ranges_path, os.stat(partial_path).st_size)
+    if missing is not None:
+        raise HTTPException(status_code=400, detail=f"Загрузка не завершена: не получены данные начиная с байта {missing}")
+    
+    with open(partial_path, "rb") as f:
+        header = f.read(VIDEO_HEADER_SIZE)
+    if not is_video_header(header):
+        os.remove(partial_path)
+        remove_file_if_exists(ranges_path)
+        raise HTTPException(status_code=400, detail="Не удалось открыть видеофайл. Проверьте формат.")
+    
+    video_id = upload_id
+    video_path = UPLOAD_DIR / f"{video_id}{partial_path.suffix}"
+    os.replace(partial_path, video_path)
+    remove_file_if_exists(ranges_path)
+    tasks_storage.add_video(video_id, str(video_path))
+    
+    return {
+        "video_id": video_id,
+        "path": str(video_path),
+        "first_frame_jpeg": first_frame_base64(str(video_path)),
+        "message": "Видео успешно загружено"
+    }
+
 @app.get("/zones")
 async def get_zones():
     """Получает текущие зоны."""
+    zones, zones_api = await run_in_threadpool(load_current_zones)
+    
     return {
-        "zones": convert_zones_to_api_format(current_zones),
-        "count": len(current_zones)
+        "zones": zones_api,
+        "count": len(zones)
     }
 
 @app.post("/zones")
@@ -266,8 +658,6 @@ async def set_zones(zones_request: ZonesRequest):
     Зоны сохраняются глобально и используются для всех последующих анализов,
     если не указаны явно в запросе на анализ.
     """
-    global current_zones
-    
     # Конвертируем в внутренний формат
     new_zones = convert_zones_to_internal_format(zones_request.zones)
     
@@ -285,56 +675,58 @@ async def set_zones(zones_request: ZonesRequest):
                 detail=f"Зона '{zone_name}': top_left должен быть меньше bottom_right"
             )
     
-    # Обновляем зоны
-    current_zones = new_zones
-    
-    # Сохраняем в файл
+    # Сохраняем в файл: он общий для всех воркеров, они перечитают его при следующем запросе
     zones_to_save = {}
-    for zone_name, rect in current_zones.items():
+    for zone_name, rect in new_zones.items():
         zones_to_save[zone_name] = {
             "top_left": list(rect[0]),
             "bottom_right": list(rect[1])
         }
     
+    zones_json = json.dumps(zones_to_save, ensure_ascii=False, indent=2)
+    
+    # Пишем во временный файл и атомарно подменяем: при сбое старый файл останется целым
+    tmp_path = f"{ZONES_FILE}.{uuid.uuid4().hex}.tmp"
     try:
-        with open(ZONES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(zones_to_save, f, ensure_ascii=False, indent=2)
+        async with aiofiles.open(tmp_path, 'w', encoding='utf-8') as f:
+            await f.write(zones_json)
+        await run_in_threadpool(os.replace, tmp_path, ZONES_FILE)
     except Exception as e:
+        await run_in_threadpool(remove_file_if_exists, tmp_path)
         raise HTTPException(status_code=500, detail=f"Ошибка сохранения зон: {str(e)}")
     
+    # Кэш зон не трогаем: он обновится по новой подписи файла при следующем чтении
     return {
-        "message": f"Установлено зон: {len(current_zones)}",
-        "zones": convert_zones_to_api_format(current_zones)
+        "message": f"Установлено зон: {len(new_zones)}",
+        "zones": convert_zones_to_api_format(new_zones)
     }
 
 @app.post("/analyze")
-async def analyze_video(request: AnalyzeRequest, background_tasks: BackgroundTasks):
+async def analyze_video(request: AnalyzeRequest):
     """
     Запускает анализ видео.
     
     Если зоны не указаны в запросе, используются текущие глобальные зоны.
     """
     # Проверяем наличие видео
-    video_files = list(UPLOAD_DIR.glob(f"{request.video_id}.*"))
-    if not video_files:
+    video_path = await run_in_threadpool(tasks_storage.get_video_path, request.video_id)
+    if video_path is None:
         raise HTTPException(status_code=404, detail=f"Видео с ID {request.video_id} не найдено")
     
-    video_path = str(video_files[0])
-    
     # Определяем зоны для использования
     if request.zones:
         zones = convert_zones_to_internal_format(request.zones)
     else:
-        if not current_zones:
+        zones, _ = await run_in_threadpool(load_current_zones)
+        if not zones:
             raise HTTPException(
                 status_code=400,
                 detail="Зоны не установлены. Используйте POST /zones для установки зон или укажите их в запросе."
             )
-        zones = current_zones
     
     # Создаем задачу
     task_id = str(uuid.uuid4())
-    tasks_storage[task_id] = {
+    await run_in_threadpool(tasks_storage.create, {
         "task_id": task_id,
         "status": TaskStatus.PENDING,
         "video_id": request.video_id,
@@ -342,11 +734,13 @@ async def analyze_video(request: AnalyzeRequest, background_tasks: BackgroundTas
         "completed_at": None,
         "error": None,
         "statistics": None,
-        "visualization_path": None
-    }
+        "visualization_path": None,
+        "zones": zones,  # Нужны для перезапуска задачи после рестарта API
+        "worker_id": WORKER_ID
+    })
     
-    # Запускаем обработку в фоне
-    background_tasks.add_task(process_video_task, task_id, video_path, zones)
+    # Запускаем обработку в пуле процессов
+    schedule_analysis(task_id, video_path, zones)
     
     return {
         "task_id": task_id,
@@ -355,30 +749,62 @@ async def analyze_video(request: AnalyzeRequest, background_tasks: BackgroundTas
     }
 
 @app.get("/tasks/{task_id}")
-async def get_task(task_id: str):
-    """Получает статус задачи."""
-    if task_id not in tasks_storage:
+async def get_task(
+    task_id: str,
+    wait_for: Optional[str] = Query(None, description="Статусы через запятую: ответить, когда задача перейдет в один из них"),
+    timeout: float = Query(0.0, ge=0.0, le=MAX_TASK_WAIT_TIMEOUT, description="Сколько секунд ждать статуса из wait_for")
+):
+    """
+    Получает статус задачи.
+    
+    С wait_for работает как long polling: ответ приходит, как только задача перейдет
+    в один из указанных статусов, или по истечении timeout с текущим статусом.
+    """
+    task = await run_in_threadpool(tasks_storage.get, task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Задача не найдена")
     
-    task = tasks_storage[task_id]
-    return TaskResponse(**task)
+    if wait_for and timeout > 0:
+        wanted = {status.strip() for status in wait_for.split(",")}
+        # Задачу может обновлять другой воркер Uvicorn, поэтому ждем по хранилищу, а не по событию в процессе
+        deadline = asyncio.get_running_loop().time() + timeout
+        while task["status"] not in wanted and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(TASK_WAIT_POLL_INTERVAL)
+            task = await run_in_threadpool(tasks_storage.get, task_id)
+            if task is None:
+                raise HTTPException(status_code=404, detail="Задача не найдена")
+    
+    return task_response(task)
+
+# Эндпоинты ниже работают только с SQLite и файлами, поэтому объявлены через def:
+# Starlette выполняет их в пуле потоков, и event loop не блокируется
 
 @app.get("/tasks")
-async def get_all_tasks():
-    """Получает список всех задач."""
+def get_all_tasks(
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    status: Optional[TaskStatus] = None
+):
+    """
+    Получает список задач постранично.
+    
+    Модели ответа строятся только для запрошенной страницы, total - общее число задач с учетом фильтра.
+    """
+    tasks = tasks_storage.list_tasks(limit, offset, status)
     return {
-        "tasks": [TaskResponse(**task) for task in tasks_storage.values()],
-        "total": len(tasks_storage)
+        "tasks": [task_response(task) for task in tasks],
+        "total": tasks_storage.count(status),
+        "limit": limit,
+        "offset": offset
     }
 
 @app.get("/statistics/{task_id}")
-async def get_statistics(task_id: str):
+def get_statistics(task_id: str):
     """Получает статистику по завершенной задаче."""
-    if task_id not in tasks_storage:
+    task = tasks_storage.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Задача не найдена")
     
-    task = tasks_storage[task_id]
-    
     if task["status"] != TaskStatus.COMPLETED:
         raise HTTPException(
             status_code=400,
@@ -394,12 +820,15 @@ async def get_statistics(task_id: str):
     }
 
 @app.get("/visualization/{task_id}")
-async def get_visualization(task_id: str):
-    """Получает визуализацию по завершенной задаче."""
-    if task_id not in tasks_storage:
-        raise HTTPException(status_code=404, detail="Задача не найдена")
+def get_visualization(task_id: str, request: Request):
+    """
+    Получает визуализацию по завершенной задаче.
     
-    task = tasks_storage[task_id]
+    Поддерживает If-None-Match: при совпадении ETag возвращается 304 без тела.
+    """
+    task = tasks_storage.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
     
     if task["status"] != TaskStatus.COMPLETED:
         raise HTTPException(
@@ -408,23 +837,41 @@ async def get_visualization(task_id: str):
         )
     
     visualization_path = task.get("visualization_path")
-    if not visualization_path or not os.path.exists(visualization_path):
+    if not visualization_path:
         raise HTTPException(status_code=404, detail="Визуализация не найдена")
+    try:
+        file_stat = os.stat(visualization_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Визуализация не найдена")
+    
+    headers = {
+        "ETag": visualization_etag(visualization_path, file_stat),
+        "Cache-Control": VISUALIZATION_CACHE_CONTROL
+    }
     
+    # Клиент уже получил этот файл - не передаем его повторно
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        client_etags = {tag.strip().replace("W/", "", 1) for tag in if_none_match.split(",")}
+        if headers["ETag"] in client_etags or "*" in client_etags:
+            return Response(status_code=304, headers=headers)
+    
+    # FileResponse отдает файл через sendfile, когда сервер это поддерживает
     return FileResponse(
         visualization_path,
         media_type="image/png",
-        filename=f"visualization_{task_id}.png"
+        filename=f"visualization_{task_id}.png",
+        headers=headers,
+        stat_result=file_stat
     )
 
 @app.delete("/tasks/{task_id}")
-async def delete_task(task_id: str):
+def delete_task(task_id: str):
     """Удаляет задачу и связанные файлы."""
-    if task_id not in tasks_storage:
+    task = tasks_storage.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Задача не найдена")
     
-    task = tasks_storage[task_id]
-    
     # Удаляем визуализацию, если есть
     visualization_path = task.get("visualization_path")
     if visualization_path and os.path.exists(visualization_path):
@@ -434,56 +881,35 @@ async def delete_task(task_id: str):
             print(f"Ошибка удаления визуализации: {e}")
     
     # Удаляем задачу
-    del tasks_storage[task_id]
+    tasks_storage.delete(task_id)
     
     return {"message": "Задача удалена"}
 
 @app.get("/videos/{video_id}/first-frame")
 async def get_first_frame(video_id: str):
     """Получает первый кадр видео в формате изображения."""
-    video_files = list(UPLOAD_DIR.glob(f"{video_id}.*"))
-    if not video_files:
+    video_path = await run_in_threadpool(tasks_storage.get_video_path, video_id)
+    if video_path is None:
         raise HTTPException(status_code=404, detail="Видео не найдено")
     
-    video_path = str(video_files[0])
-    
-    # Открываем видео и читаем первый кадр
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        raise HTTPException(status_code=400, detail="Не удалось открыть видеофайл")
-    
-    ret, frame = cap.read()
-    cap.release()
-    
-    if not ret:
-        raise HTTPException(status_code=400, detail="Не удалось прочитать первый кадр")
-    
-    # Конвертируем BGR в RGB
-    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    # Декодирование и кодирование в JPEG выполняются вне event loop
+    jpeg_bytes = await run_in_threadpool(read_first_frame_jpeg, video_path)
     
-    # Кодируем в JPEG
-    import io
-    from PIL import Image
-    pil_image = Image.fromarray(frame_rgb)
-    img_bytes = io.BytesIO()
-    pil_image.save(img_bytes, format='JPEG')
-    img_bytes.seek(0)
-    
-    from fastapi.responses import Response
-    return Response(content=img_bytes.getvalue(), media_type="image/jpeg")
+    return Response(content=jpeg_bytes, media_type="image/jpeg")
 
 @app.delete("/videos/{video_id}")
-async def delete_video(video_id: str):
+def delete_video(video_id: str):
     """Удаляет загруженное видео."""
-    video_files = list(UPLOAD_DIR.glob(f"{video_id}.*"))
-    if not video_files:
+    video_path = tasks_storage.get_video_path(video_id)
+    if video_path is None:
         raise HTTPException(status_code=404, detail="Видео не найдено")
     
-    for video_file in video_files:
-        try:
-            os.remove(video_file)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Ошибка удаления файла: {str(e)}")
+    try:
+        remove_file_if_exists(video_path)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка удаления файла: {str(e)}")
+    
+    tasks_storage.delete_video(video_id)
     
     return {"message": "Видео удалено"}
 
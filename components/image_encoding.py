@@ -0,0 +1,68 @@
+"""
+Кодирование кадров в data URL для компонентов выделения зон
+Результат кэшируется, чтобы не перекодировать кадр при каждом перезапуске скрипта
+"""
+
+import binascii
+import io
+from typing import Optional
+
+import numpy as np
+import streamlit as st
+from PIL import Image
+
+# Качество JPEG для фона компонентов (потери незаметны при выделении зон)
+JPEG_QUALITY = 85
+
+
+# Режим PIL по числу каналов кадра
+_PIL_MODES = {1: "L", 3: "RGB", 4: "RGBA"}
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _encode_data_url(image_bytes: bytes, shape: tuple, max_width: Optional[int] = None) -> str:
+    """Кодирует пиксели кадра в JPEG (уменьшая до max_width) и возвращает data URL."""
+    height, width = shape[:2]
+    mode = _PIL_MODES[shape[2] if len(shape) == 3 else 1]
+    # frombuffer оборачивает уже готовые байты кадра без промежуточного numpy-массива и копии
+    pil_image = Image.frombuffer(mode, (width, height), image_bytes, "raw", mode, 0, 1)
+    if pil_image.mode not in ("RGB", "L"):
+        pil_image = pil_image.convert("RGB")
+    if max_width and width > max_width:
+        # BOX-усреднение, как INTER_AREA в OpenCV: без муара при сильном уменьшении
+        pil_image = pil_image.resize((max_width, round(height * max_width / width)), Image.BOX)
+
+    buffered = io.BytesIO()
+    # optimize=False: дополнительный проход оптимизации Хаффмана почти не уменьшает data URL
+    pil_image.save(buffered, format="JPEG", quality=JPEG_QUALITY, optimize=False)
+    # getbuffer() отдает содержимое BytesIO без копии, в отличие от getvalue()
+    img_str = binascii.b2a_base64(buffered.getbuffer(), newline=False).decode("ascii")
+    return f"data:image/jpeg;base64,{img_str}"
+
+
+def image_to_data_url(image: np.ndarray, max_width: Optional[int] = None) -> str:
+    """
+    Возвращает data URL для кадра, используя кэш Streamlit.
+
+    Args:
+        image: numpy array изображения (RGB, uint8)
+        max_width: если кадр шире, он уменьшается до этой ширины с сохранением пропорций
+
+    Returns:
+        строка вида data:image/jpeg;base64,...
+    """
+    # Тот же объект кадра (он хранится в session_state между перезапусками) отдается сразу:
+    # без копии tobytes() и хэширования всех пикселей ради ключа st.cache_data.
+    # В кэше хранится сам кадр, поэтому сравнение по `is` надежно.
+    # Ключ зависит от max_width, чтобы компоненты с разной шириной не вытесняли друг друга
+    cache_key = f"_image_data_url_{max_width}"
+    cached = st.session_state.get(cache_key)
+    if cached is not None and cached[0] is image:
+        return cached[1]
+
+    source = image
+    if image.dtype != np.uint8:
+        image = image.astype(np.uint8)
+    data_url = _encode_data_url(image.tobytes(), image.shape, max_width)
+    st.session_state[cache_key] = (source, data_url)
+    return data_url
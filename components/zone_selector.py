@@ -5,11 +5,10 @@
 import streamlit.components.v1 as components
 import json
 import numpy as np
-import base64
-from PIL import Image
-import io
 import os
 
+from .image_encoding import image_to_data_url
+
 _RELEASE = True
 
 # Создаем папку для компонента если нужно
@@ -36,13 +35,9 @@ def zone_selector(image, zones=None, key=None):
         словарь зон или None
     """
     
-    # Конвертируем изображение в base64
+    # Конвертируем изображение в base64 (кэшируется между перезапусками)
     if isinstance(image, np.ndarray):
-        pil_image = Image.fromarray(image)
-        buffered = io.BytesIO()
-        pil_image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        img_data = f"data:image/png;base64,{img_str}"
+        img_data = image_to_data_url(image)
         img_width = image.shape[1]
         img_height = image.shape[0]
     else:
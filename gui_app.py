@@ -7,14 +7,22 @@ GUI приложение для анализа зон магазина
 import streamlit as st
 import cv2
 import numpy as np
+import base64
 import json
+import mimetypes
+import orjson
 import os
 import pandas as pd
 import requests
 import time
-from typing import Dict, Optional
-from PIL import Image
-import io
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+from functools import lru_cache
 
 # Импортируем утилиту для предотвращения свайпа назад
 from components.swipe_back_handler import prevent_swipe_back
@@ -32,6 +40,22 @@ prevent_swipe_back()
 # Настройка API URL
 API_URL = os.getenv("API_URL", "http://localhost:8888")
 
+# Таймауты запросов к API (подключение, чтение): подключение к недоступному API
+# обрывается быстро, а чтение ответа может занимать дольше
+CONNECT_TIMEOUT = 1.5
+FAST_TIMEOUT = (CONNECT_TIMEOUT, 5)
+MEDIUM_TIMEOUT = (CONNECT_TIMEOUT, 10)
+SLOW_TIMEOUT = (CONNECT_TIMEOUT, 30)
+
+# Показывать полные трассировки ошибок в интерфейсе (GUI_DEBUG=1)
+DEBUG = os.getenv("GUI_DEBUG", "0") == "1"
+
+# Тела JSON-запросов сериализуются через orjson и отправляются как data с этим заголовком
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Зона в состоянии сессии: неизменяемый кортеж (x1, y1, x2, y2)
+Zone = Tuple[int, int, int, int]
+
 # Инициализация состояния
 if 'api_url' not in st.session_state:
     st.session_state.api_url = API_URL
@@ -39,6 +63,8 @@ if 'zones' not in st.session_state:
     st.session_state.zones = {}
 if 'video_id' not in st.session_state:
     st.session_state.video_id = None
+if 'uploaded_file_id' not in st.session_state:
+    st.session_state.uploaded_file_id = None
 if 'frame' not in st.session_state:
     st.session_state.frame = None
 if 'frame_loaded' not in st.session_state:
@@ -52,16 +78,47 @@ if 'analysis_complete' not in st.session_state:
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 # ============================================================================
 
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """
+    Общая HTTP-сессия для запросов к API.
+    
+    Сессия переиспользует TCP-соединения (keep-alive), поэтому опрос статуса задачи
+    не открывает новое соединение на каждый перезапуск. cache_resource сохраняет ее между перезапусками.
+    """
+    session = requests.Session()
+    # Повторяем только идемпотентные запросы (urllib3 не повторяет POST) при кратковременных ошибках прокси
+    retries = Retry(total=2, connect=1, backoff_factor=0.2, status_forcelist=[502, 503, 504], raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def zone_from_api(coords: Dict) -> Zone:
+    """Конвертирует зону из формата API {"top_left", "bottom_right"} во внутренний кортеж."""
+    (x1, y1), (x2, y2) = coords["top_left"], coords["bottom_right"]
+    return (int(x1), int(y1), int(x2), int(y2))
+
+def zone_to_api(zone: Zone) -> Dict:
+    """Конвертирует внутренний кортеж зоны в формат API."""
+    x1, y1, x2, y2 = zone
+    return {"top_left": [x1, y1], "bottom_right": [x2, y2]}
+
+# Сколько секунд результат проверки подключения к API переиспользуется между перезапусками
+API_CHECK_TTL = 10
+
+@st.cache_data(ttl=API_CHECK_TTL, show_spinner=False)
 def check_api_connection(api_url: str) -> bool:
-    """Проверяет подключение к API."""
+    """Проверяет подключение к API (результат кэшируется на API_CHECK_TTL секунд)."""
     try:
-        response = requests.get(f"{api_url}/", timeout=5)
+        # Короткий таймаут: проверка выполняется при отрисовке страницы
+        response = get_http_session().get(f"{api_url}/", timeout=(CONNECT_TIMEOUT, 2))
         if response.status_code == 200:
             # Проверяем, что это действительно наш API (должен вернуть JSON)
             content_type = response.headers.get('content-type', '')
             if 'application/json' in content_type:
                 try:
-                    data = response.json()
+                    data = orjson.loads(response.content)
                     # Проверяем, что это наш API по наличию поля "message"
                     return data.get("message") == "Анализатор зон магазина API"
                 except:
@@ -73,30 +130,45 @@ def check_api_connection(api_url: str) -> bool:
     except Exception:
         return False
 
-def upload_video_to_api(api_url: str, file_bytes: bytes, filename: str) -> Optional[Dict]:
-    """Загружает видео на сервер через API."""
+def upload_video_to_api(api_url: str, file_obj: BinaryIO, filename: str, file_size: int,
+                        on_progress: Optional[Callable[[float], None]] = None) -> Optional[Dict]:
+    """
+    Загружает видео на сервер через API.
+    
+    Тело multipart-запроса отправляется потоком из файлового объекта (MultipartEncoder),
+    а не собирается в памяти целиком, поэтому многогигабайтное видео не копируется в RAM.
+    on_progress получает долю отправленных байт (0..1).
+    """
     try:
-        # Определяем MIME тип по расширению
-        file_ext = os.path.splitext(filename)[1].lower()
-        mime_types = {
-            '.mp4': 'video/mp4',
-            '.avi': 'video/x-msvideo',
-            '.mov': 'video/quicktime',
-            '.mkv': 'video/x-matroska',
-            '.flv': 'video/x-flv'
-        }
-        mime_type = mime_types.get(file_ext, 'video/mp4')
+        # Определяем MIME тип по расширению (сервер все равно проверяет формат по сигнатуре файла)
+        mime_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
         
-        files = {"file": (filename, file_bytes, mime_type)}
+        file_obj.seek(0)
+        encoder = MultipartEncoder(fields={"file": (filename, file_obj, mime_type)})
+        if on_progress is not None:
+            # Сообщаем прогресс только при смене целого процента: колбэк вызывается на каждый прочитанный блок
+            last_percent = -1
+            
+            def report_progress(monitor: MultipartEncoderMonitor):
+                nonlocal last_percent
+                percent = monitor.bytes_read * 100 // monitor.len
+                if percent != last_percent:
+                    last_percent = percent
+                    on_progress(percent / 100)
+            
+            body = MultipartEncoderMonitor(encoder, report_progress)
+        else:
+            body = encoder
         
         # Увеличиваем таймаут для больших файлов
-        file_size_mb = len(file_bytes) / (1024 * 1024)
+        file_size_mb = file_size / (1024 * 1024)
         timeout = max(60, int(file_size_mb * 2))  # 2 секунды на МБ, минимум 60 секунд
         
-        response = requests.post(
+        response = get_http_session().post(
             f"{api_url}/upload-video",
-            files=files,
-            timeout=timeout
+            data=body,
+            headers={"Content-Type": body.content_type},
+            timeout=(CONNECT_TIMEOUT, timeout)
         )
         
         if response.status_code == 200:
@@ -104,7 +176,7 @@ def upload_video_to_api(api_url: str, file_bytes: bytes, filename: str) -> Optio
             content_type = response.headers.get('content-type', '')
             if 'application/json' in content_type or not content_type:
                 try:
-                    return response.json()
+                    return orjson.loads(response.content)
                 except ValueError as e:
                     st.error(f"Ошибка парсинга JSON ответа: {str(e)}")
                     st.error(f"Content-Type: {content_type}")
@@ -129,7 +201,7 @@ def upload_video_to_api(api_url: str, file_bytes: bytes, filename: str) -> Optio
             
             # Пытаемся получить JSON ошибку, если есть
             try:
-                error_data = response.json()
+                error_data = orjson.loads(response.content)
                 error_msg = error_data.get('detail', str(error_data))
             except ValueError:
                 # Если не JSON, показываем текст ошибки
@@ -143,72 +215,178 @@ def upload_video_to_api(api_url: str, file_bytes: bytes, filename: str) -> Optio
         st.error("Превышено время ожидания. Файл слишком большой или сервер не отвечает.")
         return None
     except Exception as e:
-        st.error(f"Ошибка подключения к API: {str(e)}")
-        import traceback
-        st.error(f"Детали: {traceback.format_exc()}")
+        st.error(f"Ошибка подключения к API: {type(e).__name__}: {e}")
+        if DEBUG:
+            st.error(f"Детали: {traceback.format_exc()}")
+        return None
+
+# Загрузка по частям: размер части и число параллельных запросов
+UPLOAD_PART_SIZE = 32 * 1024 * 1024
+UPLOAD_WORKERS = 3
+
+def upload_video_chunked(api_url: str, file_obj: BinaryIO, filename: str, file_size: int,
+                         on_progress: Optional[Callable[[float], None]] = None) -> Optional[Dict]:
+    """
+    Загружает видео параллельными частями (PUT по смещениям), а затем завершает загрузку.
+    
+    Небольшие файлы и серверы без эндпоинтов загрузки по частям обслуживает upload_video_to_api.
+    В памяти одновременно держится не больше UPLOAD_WORKERS частей.
+    """
+    if file_size <= UPLOAD_PART_SIZE:
+        return upload_video_to_api(api_url, file_obj, filename, file_size, on_progress)
+    
+    session = get_http_session()
+    try:
+        response = session.post(
+            f"{api_url}/upload-video/init",
+            data=orjson.dumps({"filename": filename, "size": file_size}),
+            headers=JSON_HEADERS,
+            timeout=MEDIUM_TIMEOUT
+        )
+        if response.status_code in (404, 405):
+            # Старая версия API без загрузки по частям
+            return upload_video_to_api(api_url, file_obj, filename, file_size, on_progress)
+        response.raise_for_status()
+        upload_id = orjson.loads(response.content)["upload_id"]
+        
+        # Файловый объект общий для потоков, поэтому seek + read выполняются под блокировкой
+        read_lock = threading.Lock()
+        
+        def send_part(offset: int) -> int:
+            with read_lock:
+                file_obj.seek(offset)
+                data = file_obj.read(UPLOAD_PART_SIZE)
+            part_response = session.put(
+                f"{api_url}/upload-video/{upload_id}/part",
+                params={"offset": offset},
+                data=data,
+                timeout=(CONNECT_TIMEOUT, max(60, len(data) * 2 // (1024 * 1024)))
+            )
+            part_response.raise_for_status()
+            return len(data)
+        
+        sent = 0
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            futures = [executor.submit(send_part, offset) for offset in range(0, file_size, UPLOAD_PART_SIZE)]
+            try:
+                # Прогресс обновляется из основного потока: Streamlit не принимает вызовы из других потоков
+                for future in as_completed(futures):
+                    sent += future.result()
+                    if on_progress is not None:
+                        on_progress(sent / file_size)
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+        
+        response = session.post(f"{api_url}/upload-video/{upload_id}/complete", timeout=SLOW_TIMEOUT)
+        response.raise_for_status()
+        return orjson.loads(response.content)
+    except requests.exceptions.HTTPError as e:
+        try:
+            error_msg = orjson.loads(e.response.content).get('detail', e.response.text)
+        except ValueError:
+            error_msg = e.response.text[:500] if e.response.text else str(e)
+        st.error(f"Ошибка загрузки видео (код {e.response.status_code}): {error_msg}")
+        return None
+    except requests.exceptions.ConnectionError:
+        st.error(f"Не удалось подключиться к API: {api_url}. Убедитесь, что сервер запущен.")
+        return None
+    except requests.exceptions.Timeout:
+        st.error("Превышено время ожидания. Файл слишком большой или сервер не отвечает.")
+        return None
+    except Exception as e:
+        st.error(f"Ошибка загрузки видео: {str(e)}")
         return None
 
+def decode_image(data: bytes) -> Optional[np.ndarray]:
+    """Декодирует JPEG/PNG в RGB массив или возвращает None, если данные не являются изображением."""
+    # cv2.imdecode декодирует сразу в numpy-массив, без промежуточного PIL-изображения
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+# Кадр видео и визуализация задачи не меняются для своего id, поэтому кэшируются надолго
+IMAGE_CACHE_TTL = 3600
+IMAGE_CACHE_MAX_ENTRIES = 16
+
+@st.cache_data(ttl=IMAGE_CACHE_TTL, max_entries=IMAGE_CACHE_MAX_ENTRIES, show_spinner=False)
+def fetch_image_from_api(url: str, timeout: Tuple[float, float]) -> np.ndarray:
+    """
+    Скачивает и декодирует изображение из API.
+    
+    При ошибке бросает исключение, а не возвращает None, чтобы неудачный ответ не попал в кэш.
+    """
+    with get_http_session().get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        # Читаем тело напрямую из потока, минуя сборку response.content из блоков
+        data = response.raw.read(decode_content=True)
+    
+    image = decode_image(data)
+    if image is None:
+        raise ValueError("Не удалось декодировать изображение")
+    return image
+
 def get_first_frame_from_api(api_url: str, video_id: str) -> Optional[np.ndarray]:
     """Получает первый кадр видео через API."""
     try:
-        response = requests.get(f"{api_url}/videos/{video_id}/first-frame", timeout=10)
-        if response.status_code == 200:
-            # Декодируем изображение
-            img = Image.open(io.BytesIO(response.content))
-            return np.array(img)
-        else:
-            return None
+        return fetch_image_from_api(f"{api_url}/videos/{video_id}/first-frame", MEDIUM_TIMEOUT)
+    except requests.exceptions.HTTPError:
+        return None
     except Exception as e:
         st.error(f"Ошибка получения кадра: {str(e)}")
         return None
 
+# Сколько секунд зоны, полученные из API, переиспользуются без повторного запроса
+ZONES_CACHE_TTL = 30
+
+@st.cache_data(ttl=ZONES_CACHE_TTL, show_spinner=False)
+def fetch_zones_from_api(api_url: str) -> Dict[str, Zone]:
+    """Запрашивает зоны из API (при ошибке бросает исключение, чтобы она не попала в кэш)."""
+    response = get_http_session().get(f"{api_url}/zones", timeout=FAST_TIMEOUT)
+    response.raise_for_status()
+    data = orjson.loads(response.content)
+    # Конвертируем из API формата во внутренний
+    return {zone_name: zone_from_api(coords) for zone_name, coords in data["zones"].items()}
+
 def get_zones_from_api(api_url: str) -> Dict:
     """Получает зоны через API."""
     try:
-        response = requests.get(f"{api_url}/zones", timeout=5)
-        if response.status_code == 200:
-            try:
-                data = response.json()
-                # Конвертируем из API формата во внутренний
-                zones = {}
-                for zone_name, coords in data["zones"].items():
-                    zones[zone_name] = [
-                        tuple(coords["top_left"]),
-                        tuple(coords["bottom_right"])
-                    ]
-                return zones
-            except ValueError as e:
-                st.warning(f"Ошибка парсинга ответа зон: {str(e)}")
-                return {}
-        else:
-            return {}
+        return fetch_zones_from_api(api_url)
+    except requests.exceptions.HTTPError:
+        return {}
+    except ValueError as e:
+        st.warning(f"Ошибка парсинга ответа зон: {str(e)}")
+        return {}
     except Exception as e:
         st.warning(f"Ошибка получения зон: {str(e)}")
         return {}
 
 def set_zones_to_api(api_url: str, zones: Dict) -> bool:
-    """Устанавливает зоны через API."""
+    """Устанавливает зоны через API (не отправляет запрос, если эти же зоны уже сохранены)."""
+    saved_key = (api_url, freeze_zones(zones))
+    if st.session_state.get("saved_zones_key") == saved_key:
+        return True
+    
     try:
         # Конвертируем во внутренний формат в API формат
         zones_request = {
-            "zones": {
-                zone_name: {
-                    "top_left": list(rect[0]),
-                    "bottom_right": list(rect[1])
-                }
-                for zone_name, rect in zones.items()
-            }
+            "zones": {zone_name: zone_to_api(zone) for zone_name, zone in zones.items()}
         }
-        response = requests.post(
+        response = get_http_session().post(
             f"{api_url}/zones",
-            json=zones_request,
-            timeout=10
+            data=orjson.dumps(zones_request),
+            headers=JSON_HEADERS,
+            timeout=MEDIUM_TIMEOUT
         )
         if response.status_code == 200:
+            st.session_state.saved_zones_key = saved_key
+            fetch_zones_from_api.clear()
             return True
         else:
             try:
-                error_data = response.json()
+                error_data = orjson.loads(response.content)
                 error_msg = error_data.get('detail', response.text)
             except:
                 error_msg = response.text
@@ -221,35 +399,34 @@ def set_zones_to_api(api_url: str, zones: Dict) -> bool:
         st.error(f"Ошибка установки зон: {str(e)}")
         return False
 
-def start_analysis(api_url: str, video_id: str, zones: Optional[Dict] = None) -> Optional[str]:
-    """Запускает анализ через API."""
+def start_analysis(api_url: str, video_id: str, zones: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    Запускает анализ через API одним запросом: зоны передаются вместе с видео.
+    
+    Возвращает ответ /analyze (task_id и начальный статус задачи) или None при ошибке.
+    """
     try:
         request_data = {"video_id": video_id}
         if zones:
-            request_data["zones"] = {
-                zone_name: {
-                    "top_left": list(rect[0]),
-                    "bottom_right": list(rect[1])
-                }
-                for zone_name, rect in zones.items()
-            }
+            request_data["zones"] = {zone_name: zone_to_api(zone) for zone_name, zone in zones.items()}
         
-        response = requests.post(
+        response = get_http_session().post(
             f"{api_url}/analyze",
-            json=request_data,
-            timeout=10
+            data=orjson.dumps(request_data),
+            headers=JSON_HEADERS,
+            timeout=MEDIUM_TIMEOUT
         )
         if response.status_code == 200:
             try:
-                data = response.json()
-                return data.get("task_id")
+                data = orjson.loads(response.content)
+                return data if data.get("task_id") else None
             except ValueError as e:
                 st.error(f"Ошибка парсинга ответа: {str(e)}")
                 st.error(f"Ответ сервера: {response.text[:500]}")
                 return None
         else:
             try:
-                error_data = response.json()
+                error_data = orjson.loads(response.content)
                 error_msg = error_data.get('detail', response.text)
             except:
                 error_msg = response.text
@@ -262,13 +439,27 @@ def start_analysis(api_url: str, video_id: str, zones: Optional[Dict] = None) ->
         st.error(f"Ошибка подключения к API: {str(e)}")
         return None
 
-def get_task_status(api_url: str, task_id: str) -> Optional[Dict]:
-    """Получает статус задачи через API."""
+# Long polling статуса задачи: сколько секунд сервер ждет смены статуса в одном запросе.
+# Пока идет запрос, скрипт Streamlit занят, поэтому ожидание не слишком долгое
+TASK_WAIT_TIMEOUT = 10
+
+def get_task_status(api_url: str, task_id: str, wait_for: Optional[List[str]] = None) -> Optional[Dict]:
+    """
+    Получает статус задачи через API.
+    
+    С wait_for сервер отвечает, когда задача перейдет в один из этих статусов
+    (или через TASK_WAIT_TIMEOUT секунд), вместо немедленного ответа.
+    """
     try:
-        response = requests.get(f"{api_url}/tasks/{task_id}", timeout=5)
+        params = None
+        timeout = FAST_TIMEOUT
+        if wait_for:
+            params = {"wait_for": ",".join(wait_for), "timeout": TASK_WAIT_TIMEOUT}
+            timeout = (CONNECT_TIMEOUT, TASK_WAIT_TIMEOUT + 5)
+        response = get_http_session().get(f"{api_url}/tasks/{task_id}", params=params, timeout=timeout)
         if response.status_code == 200:
             try:
-                return response.json()
+                return orjson.loads(response.content)
             except ValueError:
                 return None
         else:
@@ -276,13 +467,21 @@ def get_task_status(api_url: str, task_id: str) -> Optional[Dict]:
     except:
         return None
 
+def wait_for_task_status(api_url: str, task_id: str, statuses: List[str]) -> None:
+    """Ждет, пока задача перейдет в один из статусов, одним запросом long polling."""
+    started = time.monotonic()
+    task = get_task_status(api_url, task_id, wait_for=statuses)
+    # API без long polling отвечает сразу: в этом случае не опрашиваем его чаще раза в секунду
+    if (task is None or task.get("status") not in statuses) and time.monotonic() - started < 1:
+        time.sleep(1)
+
 def get_statistics(api_url: str, task_id: str) -> Optional[Dict]:
     """Получает статистику через API."""
     try:
-        response = requests.get(f"{api_url}/statistics/{task_id}", timeout=5)
+        response = get_http_session().get(f"{api_url}/statistics/{task_id}", timeout=FAST_TIMEOUT)
         if response.status_code == 200:
             try:
-                return response.json()
+                return orjson.loads(response.content)
             except ValueError:
                 return None
         else:
@@ -293,29 +492,78 @@ def get_statistics(api_url: str, task_id: str) -> Optional[Dict]:
 def get_visualization(api_url: str, task_id: str) -> Optional[np.ndarray]:
     """Получает визуализацию через API."""
     try:
-        response = requests.get(f"{api_url}/visualization/{task_id}", timeout=30)
-        if response.status_code == 200:
-            img = Image.open(io.BytesIO(response.content))
-            return np.array(img)
-        else:
-            return None
+        return fetch_image_from_api(f"{api_url}/visualization/{task_id}", SLOW_TIMEOUT)
     except:
         return None
 
-def draw_zones_on_frame(frame: np.ndarray, zones: Dict) -> np.ndarray:
-    """Рисует зоны на кадре."""
-    frame_copy = frame.copy()
+def draw_zones_on_frame(frame: np.ndarray, zones: Dict[str, Zone], inplace: bool = False) -> np.ndarray:
+    """
+    Рисует зоны на кадре.
+    
+    По умолчанию рисует на копии. inplace=True рисует прямо в переданном кадре без копирования
+    (полный кадр 1080p - около 6 МБ); его можно передавать, только если кадр больше нигде не используется.
+    """
+    frame_copy = frame if inplace else frame.copy()
+    if not zones:
+        return frame_copy
     
-    for zone_name, rect in zones.items():
-        (x1, y1), (x2, y2) = rect
-        # Рисуем прямоугольник
-        cv2.rectangle(frame_copy, (x1, y1), (x2, y2), (0, 255, 0), 3)
-        # Добавляем название
+    color = (0, 255, 0)
+    half = 1  # Рамка толщиной 3 пикселя с центром на границе зоны, как у cv2.rectangle
+    h, w = frame_copy.shape[:2]
+    limits = [w, h, w, h]
+    
+    # Внешние и внутренние границы всех рамок считаем одним массивом, обрезая по размеру кадра
+    corners = np.array(list(zones.values()), dtype=np.int32)
+    rects = np.hstack([np.minimum(corners[:, :2], corners[:, 2:]), np.maximum(corners[:, :2], corners[:, 2:])])
+    outer = np.clip(rects + [-half, -half, half + 1, half + 1], 0, limits)
+    inner = np.clip(rects + [half + 1, half + 1, -half, -half], 0, limits)
+    
+    # Рамки рисуем присваиванием срезов (четыре полосы на зону) вместо cv2.rectangle
+    for (ox1, oy1, ox2, oy2), (ix1, iy1, ix2, iy2) in zip(outer.tolist(), inner.tolist()):
+        frame_copy[oy1:iy1, ox1:ox2] = color
+        frame_copy[iy2:oy2, ox1:ox2] = color
+        frame_copy[oy1:oy2, ox1:ix1] = color
+        frame_copy[oy1:oy2, ix2:ox2] = color
+    
+    # Добавляем названия
+    for zone_name, (x1, y1, _, _) in zones.items():
         cv2.putText(frame_copy, zone_name, (x1, y1 - 10), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
     
     return frame_copy
 
+def freeze_zones(zones: Dict[str, Zone]) -> Tuple:
+    """Возвращает неизменяемое представление зон для ключей кэша."""
+    return tuple((name, *zone) for name, zone in zones.items())
+
+@lru_cache(maxsize=8)
+def zones_to_json(frozen_zones: Tuple) -> str:
+    """Форматирует зоны в JSON формата API (результат кэшируется, зоны меняются редко)."""
+    return json.dumps(
+        {name: {"top_left": [x1, y1], "bottom_right": [x2, y2]} for name, x1, y1, x2, y2 in frozen_zones},
+        ensure_ascii=False, indent=2
+    )
+
+def get_frame_with_zones(frame: np.ndarray, zones: Dict) -> np.ndarray:
+    """Возвращает кадр с зонами, перерисовывая его только при смене кадра или зон."""
+    zones_key = freeze_zones(zones)
+    
+    # В кэше хранится сам кадр, поэтому сравнение по `is` надежно: объект не может быть освобожден и заменен другим
+    cached = st.session_state.get("zones_overlay")
+    if cached is not None and cached[0] is frame and cached[1] == zones_key:
+        return cached[2]
+    
+    # Исходный кадр остается в session_state, поэтому рисуем не на нем, а на отдельном буфере.
+    # Буфер прошлой отрисовки переиспользуется (st.image уже закодировал его), чтобы не выделять память под кадр заново
+    if cached is not None and cached[2].shape == frame.shape and cached[2].dtype == frame.dtype:
+        buffer = cached[2]
+        np.copyto(buffer, frame)
+    else:
+        buffer = frame.copy()
+    frame_with_zones = draw_zones_on_frame(buffer, zones, inplace=True)
+    st.session_state.zones_overlay = (frame, zones_key, frame_with_zones)
+    return frame_with_zones
+
 # ============================================================================
 # ИНТЕРФЕЙС
 # ============================================================================
@@ -337,6 +585,7 @@ with st.sidebar.expander("⚙️ Настройки API"):
     
     # Проверка подключения
     if st.button("🔄 Проверить подключение", use_container_width=True):
+        check_api_connection.clear()
         st.rerun()
     
     if check_api_connection(st.session_state.api_url):
@@ -374,15 +623,28 @@ if uploaded_file is not None:
     if not check_api_connection(st.session_state.api_url):
         st.sidebar.error("❌ API недоступен. Проверьте подключение в настройках.")
     else:
-        # Загружаем видео на сервер
-        if st.session_state.video_id is None or st.session_state.frame_loaded == False:
+        # Загружаем видео на сервер один раз для каждого выбранного файла,
+        # а не при каждом перезапуске скрипта
+        if uploaded_file.file_id != st.session_state.uploaded_file_id:
             with st.spinner("Загрузка видео на сервер..."):
-                file_bytes = uploaded_file.read()
-                result = upload_video_to_api(st.session_state.api_url, file_bytes, uploaded_file.name)
+                upload_progress = st.sidebar.progress(0.0, text="Загрузка видео...")
+                result = upload_video_chunked(
+                    st.session_state.api_url, uploaded_file, uploaded_file.name, uploaded_file.size,
+                    on_progress=upload_progress.progress
+                )
+                upload_progress.empty()
                 
                 if result:
+                    # Файл запоминается только после успешной загрузки: неудачная повторится при следующем запуске
+                    st.session_state.uploaded_file_id = uploaded_file.file_id
                     st.session_state.video_id = result["video_id"]
                     st.session_state.frame_loaded = False  # Сброс для загрузки кадра
+                    # Первый кадр приходит в ответе на загрузку: отдельный запрос /first-frame не нужен
+                    if result.get("first_frame_jpeg"):
+                        frame = decode_image(base64.b64decode(result["first_frame_jpeg"]))
+                        if frame is not None:
+                            st.session_state.frame = frame
+                            st.session_state.frame_loaded = True
                     st.sidebar.success(f"✅ Видео загружено: {uploaded_file.name}")
                 else:
                     st.sidebar.error("❌ Ошибка загрузки видео")
@@ -407,103 +669,119 @@ if st.sidebar.button("📥 Загрузить зоны из API"):
         else:
             st.sidebar.info("Зоны не найдены на сервере")
 
-# Основной интерфейс
-if st.session_state.frame is not None:
-    col1, col2 = st.columns([7, 5])
+@st.fragment
+def render_zone_editor():
+    """Редактор зон. Фрагмент: взаимодействие с ним перезапускает только эту часть страницы."""
+    st.subheader("🎯 Выделение зон")
     
-    with col1:
-        st.subheader("🎯 Выделение зон")
+    # Интерактивное выделение зон с drag & drop
+    try:
+        from components.zone_selector_simple import zone_selector
         
-        # Интерактивное выделение зон с drag & drop
-        try:
-            from components.zone_selector_simple import zone_selector
-            
-            st.markdown("**🎯 Выделение зон:** Зажмите ЛКМ и перетащите мышкой для создания прямоугольника")
+        st.markdown("**🎯 Выделение зон:** Зажмите ЛКМ и перетащите мышкой для создания прямоугольника")
+        
+        # Компонент принимает и возвращает зоны углами [(x1, y1), (x2, y2)]
+        selected_zones = zone_selector(
+            st.session_state.frame, 
+            zones={name: (zone[:2], zone[2:]) for name, zone in st.session_state.zones.items()},
+            key="zone_selector_main"
+        )
+        
+        # Зоны, измененные в компоненте, сразу становятся текущими
+        # (полный перезапуск, чтобы обновился список зон вне фрагмента)
+        if selected_zones is not None:
+            st.session_state.zones = {
+                name: (x1, y1, x2, y2) for name, ((x1, y1), (x2, y2)) in selected_zones.items()
+            }
+            st.rerun()
+        
+        # Показываем инструкцию
+        st.info("""
+        💡 **Инструкция по выделению зон:**
+        1. Зажмите **ЛКМ** на изображении и перетащите для выделения прямоугольника
+        2. Введите название зоны в поле ввода в компоненте
+        3. Нажмите **➕ Добавить зону** в компоненте
+        4. Повторите для всех зон
+        
+        Зоны из компонента автоматически появляются в списке текущих зон.
+        """)
+        
+        # Поле для JSON зон (импорт зон, сохраненных ранее)
+        with st.expander("📋 Применить зоны из JSON", expanded=False):
+            zones_json_display = zones_to_json(freeze_zones(st.session_state.zones))
+            st.code(zones_json_display, language="json")
             
-            selected_zones = zone_selector(
-                st.session_state.frame, 
-                zones=st.session_state.zones,
-                key="zone_selector_main"
+            st.markdown("**Вставьте JSON зон (например, скопированный кнопкой '📋 Копировать JSON'):**")
+            zones_json_input = st.text_area(
+                "JSON зон",
+                value="",
+                height=150,
+                placeholder='{"Зона 1": {"top_left": [100, 50], "bottom_right": [300, 200]}, ...}',
+                key="zones_json_input"
             )
             
-            # Показываем инструкцию
-            st.info("""
-            💡 **Инструкция по выделению зон:**
-            1. Зажмите **ЛКМ** на изображении и перетащите для выделения прямоугольника
-            2. Введите название зоны в поле ввода в компоненте
-            3. Нажмите **➕ Добавить зону** в компоненте
-            4. Повторите для всех зон
-            5. Скопируйте JSON из компонента (кнопка "📋 Копировать JSON")
-            6. Вставьте JSON ниже и нажмите "✅ Применить зоны из JSON"
-            """)
-            
-            # Поле для JSON зон (для синхронизации с компонентом)
-            with st.expander("📋 Применить зоны из компонента (вставьте JSON)", expanded=True):
-                zones_json_display = json.dumps(
-                    {name: {"top_left": list(rect[0]), "bottom_right": list(rect[1])} 
-                     for name, rect in st.session_state.zones.items()},
-                    ensure_ascii=False, indent=2
-                )
-                st.code(zones_json_display, language="json")
-                
-                st.markdown("**Скопируйте JSON из компонента ниже (кнопка '📋 Копировать JSON') и вставьте сюда:**")
-                zones_json_input = st.text_area(
-                    "JSON зон из компонента",
-                    value="",
-                    height=150,
-                    placeholder='{"Зона 1": {"top_left": [100, 50], "bottom_right": [300, 200]}, ...}',
-                    key="zones_json_input"
-                )
-                
-                if st.button("✅ Применить зоны из JSON", key="apply_json_zones"):
-                    try:
-                        zones_data = json.loads(zones_json_input)
-                        new_zones = {}
-                        for name, coords in zones_data.items():
-                            new_zones[name] = [
-                                tuple(coords["top_left"]),
-                                tuple(coords["bottom_right"])
-                            ]
-                        st.session_state.zones = new_zones
-                        st.success(f"✅ Применено зон: {len(new_zones)}")
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"❌ Ошибка парсинга JSON: {e}")
-        except ImportError:
-            # Fallback: показываем изображение с зонами
-            frame_with_zones = draw_zones_on_frame(st.session_state.frame, st.session_state.zones)
-            st.image(frame_with_zones, use_container_width=True, caption="Первый кадр видео - выделите зоны")
-            st.warning("⚠️ Компонент для drag & drop не найден. Используйте ручной ввод.")
-        
-        # Ввод зон вручную (резервный вариант)
-        with st.expander("📝 Добавить зону вручную (если drag & drop не работает)"):
-            zone_name = st.text_input("Название зоны", key="zone_name_input")
-            col_x1, col_y1, col_x2, col_y2 = st.columns(4)
-            with col_x1:
-                x1 = st.number_input("X1", value=0, min_value=0, key="x1")
-            with col_y1:
-                y1 = st.number_input("Y1", value=0, min_value=0, key="y1")
-            with col_x2:
-                x2 = st.number_input("X2", value=100, min_value=0, key="x2")
-            with col_y2:
-                y2 = st.number_input("Y2", value=100, min_value=0, key="y2")
-            
-            if st.button("➕ Добавить зону", key="add_zone"):
-                if zone_name:
-                    st.session_state.zones[zone_name] = [(int(x1), int(y1)), (int(x2), int(y2))]
-                    st.success(f"Зона '{zone_name}' добавлена!")
+            if st.button("✅ Применить зоны из JSON", key="apply_json_zones"):
+                try:
+                    zones_data = json.loads(zones_json_input)
+                    new_zones = {name: zone_from_api(coords) for name, coords in zones_data.items()}
+                    st.session_state.zones = new_zones
+                    st.success(f"✅ Применено зон: {len(new_zones)}")
                     st.rerun()
-                else:
-                    st.error("Введите название зоны")
+                except Exception as e:
+                    st.error(f"❌ Ошибка парсинга JSON: {e}")
+    except ImportError:
+        # Fallback: показываем изображение с зонами
+        frame_with_zones = get_frame_with_zones(st.session_state.frame, st.session_state.zones)
+        # JPEG вместо PNG по умолчанию: кадр видео кодируется в разы быстрее и весит меньше
+        st.image(frame_with_zones, use_container_width=True, caption="Первый кадр видео - выделите зоны",
+                output_format="JPEG")
+        st.warning("⚠️ Компонент для drag & drop не найден. Используйте ручной ввод.")
+    
+    # Ввод зон вручную (резервный вариант)
+    with st.expander("📝 Добавить зону вручную (если drag & drop не работает)"):
+        zone_name = st.text_input("Название зоны", key="zone_name_input")
+        col_x1, col_y1, col_x2, col_y2 = st.columns(4)
+        with col_x1:
+            x1 = st.number_input("X1", value=0, min_value=0, key="x1")
+        with col_y1:
+            y1 = st.number_input("Y1", value=0, min_value=0, key="y1")
+        with col_x2:
+            x2 = st.number_input("X2", value=100, min_value=0, key="x2")
+        with col_y2:
+            y2 = st.number_input("Y2", value=100, min_value=0, key="y2")
+        
+        if st.button("➕ Добавить зону", key="add_zone"):
+            if zone_name:
+                st.session_state.zones[zone_name] = (int(x1), int(y1), int(x2), int(y2))
+                st.success(f"Зона '{zone_name}' добавлена!")
+                st.rerun()
+            else:
+                st.error("Введите название зоны")
+
+# Высота таблицы результатов: при фиксированной высоте таблица прокручивается
+# и отрисовывает только видимые строки, сколько бы ни было зон
+RESULTS_TABLE_HEIGHT = 400
+
+@st.fragment
+def render_results_table(df: pd.DataFrame):
+    """Таблица результатов. Фрагмент: прокрутка и сортировка не перезапускают всю страницу."""
+    st.dataframe(df, height=RESULTS_TABLE_HEIGHT, use_container_width=True)
+
+# Основной интерфейс
+if st.session_state.frame is not None:
+    col1, col2 = st.columns([7, 5])
+    
+    with col1:
+        render_zone_editor()
     
     with col2:
         st.subheader("📊 Текущие зоны")
         
         if st.session_state.zones:
-            for zone_name, rect in st.session_state.zones.items():
+            for zone_name, (x1, y1, x2, y2) in st.session_state.zones.items():
                 with st.container():
                     st.markdown(f"**{zone_name}**")
-                    st.code(f"[(x1={rect[0][0]}, y1={rect[0][1]}), (x2={rect[1][0]}, y2={rect[1][1]})]")
+                    st.code(f"[(x1={x1}, y1={y1}), (x2={x2}, y2={y2})]")
                     if st.button(f"🗑️ Удалить", key=f"del_{zone_name}"):
                         del st.session_state.zones[zone_name]
                         st.rerun()
@@ -527,13 +805,15 @@ if st.session_state.frame is not None:
         if st.session_state.video_id and st.session_state.zones:
             if st.button("🚀 Запустить анализ", use_container_width=True, type="primary"):
                 with st.spinner("Запуск анализа..."):
-                    task_id = start_analysis(
+                    task = start_analysis(
                         st.session_state.api_url,
                         st.session_state.video_id,
                         st.session_state.zones
                     )
-                    if task_id:
-                        st.session_state.task_id = task_id
+                    if task:
+                        st.session_state.task_id = task["task_id"]
+                        # Начальный статус уже пришел в ответе /analyze, отдельный запрос статуса не нужен
+                        st.session_state.task_snapshot = task
                         st.session_state.analysis_complete = False
                         st.success("✅ Анализ запущен!")
                     else:
@@ -549,21 +829,25 @@ if st.session_state.frame is not None:
             st.markdown("---")
             st.subheader("📊 Статус анализа")
             
-            task_status = get_task_status(st.session_state.api_url, st.session_state.task_id)
+            task_status = st.session_state.pop("task_snapshot", None)
+            if task_status is None:
+                task_status = get_task_status(st.session_state.api_url, st.session_state.task_id)
             
             if task_status:
                 status = task_status.get("status", "unknown")
                 
                 if status == "pending":
                     st.info("⏳ Ожидание обработки...")
-                    # Автоматическое обновление
-                    time.sleep(1)
+                    # Автоматическое обновление после смены статуса на сервере
+                    wait_for_task_status(
+                        st.session_state.api_url, st.session_state.task_id, ["processing", "completed", "failed"]
+                    )
                     st.rerun()
                 elif status == "processing":
                     st.info("🔄 Обработка видео... Это может занять некоторое время")
                     st.progress(0.5)  # Примерный прогресс
-                    # Автоматическое обновление
-                    time.sleep(2)
+                    # Автоматическое обновление после завершения задачи на сервере
+                    wait_for_task_status(st.session_state.api_url, st.session_state.task_id, ["completed", "failed"])
                     st.rerun()
                 elif status == "completed":
                     st.success("✅ Анализ завершен!")
@@ -575,26 +859,26 @@ if st.session_state.frame is not None:
                     st.markdown("---")
                     st.subheader("📈 Результаты анализа")
                     
-                    # Получаем статистику
-                    stats_data = get_statistics(st.session_state.api_url, st.session_state.task_id)
+                    # Статистика завершенной задачи уже пришла в ответе о статусе,
+                    # отдельный запрос нужен только для старой версии API
+                    stats_data = task_status if task_status.get("statistics") else None
+                    if stats_data is None:
+                        stats_data = get_statistics(st.session_state.api_url, st.session_state.task_id)
                     
                     if stats_data and "statistics" in stats_data:
-                        # Формируем DataFrame для таблицы
-                        results_data = []
-                        for zone_name, data in sorted(
-                            stats_data["statistics"].items(),
-                            key=lambda x: x[1]["total_time"],
-                            reverse=True
-                        ):
-                            results_data.append({
-                                "Зона": zone_name,
-                                "Суммарное время (сек)": f"{data['total_time']:.2f}",
-                                "Среднее время (сек)": f"{data['avg_time']:.2f}",
-                                "Посетителей": data['visitor_count']
-                            })
-                        
-                        df = pd.DataFrame(results_data)
-                        st.dataframe(df, use_container_width=True)
+                        # Формируем DataFrame для таблицы целиком из словаря статистики
+                        stats_df = (
+                            pd.DataFrame.from_dict(stats_data["statistics"], orient="index")
+                            .reindex(columns=["total_time", "avg_time", "visitor_count"])
+                            .sort_values("total_time", ascending=False)
+                        )
+                        df = pd.DataFrame({
+                            "Зона": stats_df.index,
+                            "Суммарное время (сек)": stats_df["total_time"].map("{:.2f}".format).to_numpy(),
+                            "Среднее время (сек)": stats_df["avg_time"].map("{:.2f}".format).to_numpy(),
+                            "Посетителей": stats_df["visitor_count"].to_numpy()
+                        })
+                        render_results_table(df)
                         
                         # Получаем визуализацию
                         visualization = get_visualization(st.session_state.api_url, st.session_state.task_id)
@@ -602,7 +886,7 @@ if st.session_state.frame is not None:
                         if visualization is not None:
                             st.subheader("🎨 Визуализация результатов")
                             st.image(visualization, use_container_width=True, 
-                                    caption="Тепловая карта и цветовые зоны")
+                                    caption="Тепловая карта и цветовые зоны", output_format="JPEG")
                         else:
                             st.warning("⚠️ Визуализация недоступна")
                     else:
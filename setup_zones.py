@@ -5,9 +5,10 @@
 
 import cv2
 import numpy as np
-import json
+import orjson
 import os
 import threading
+import time
 import queue
 from typing import List, Tuple, Optional, Dict
 
@@ -18,6 +19,15 @@ from typing import List, Tuple, Optional, Dict
 VIDEO_PATH = "vids/vid1.mp4"  # Путь к видеофайлу
 ZONES_FILE = "zones.json"  # Файл для сохранения координат зон
 OUTPUT_PYTHON_CODE = True  # Генерировать код Python для вставки в store_zone_analyzer.py
+MOUSE_REDRAW_INTERVAL_NS = 16_000_000  # Минимальный интервал перерисовки при движении мыши (~60 Гц)
+
+# Параметры отрисовки (цвета в BGR)
+WINDOW_NAME = 'Настройка зон - Выделите прямоугольники мышкой'
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+ZONE_COLOR = (0, 255, 0)  # Сохраненные зоны
+DRAWING_COLOR = (255, 0, 0)  # Выделяемый прямоугольник
+HINT_COLOR = (255, 255, 255)  # Подсказка по клавишам
+HINT_TEXT = "Нажмите 's' для сохранения, 'q' для выхода"
 
 # ============================================================================
 # ГЛОБАЛЬНЫЕ ПЕРЕМЕННЫЕ ДЛЯ ОБРАБОТКИ МЫШИ
@@ -33,7 +43,10 @@ display_frame = None
 display_scale_factor = 1.0  # Коэффициент масштабирования для отображения
 original_video_size = (0, 0)  # Исходное разрешение видео
 pending_zone_rect = None  # Ожидающий названия прямоугольник
+zones_overlay = None  # Кадр отображения с отрисованными зонами (None - требует перерисовки)
+scratch_frame = None  # Переиспользуемый буфер для вывода кадра на экран
 input_queue = queue.Queue()  # Очередь для ввода названий зон
+_last_paint_ns = 0  # Время последней перерисовки из обработчика мыши
 
 
 def mouse_callback(event, x, y, flags, param):
@@ -41,27 +54,7 @@ def mouse_callback(event, x, y, flags, param):
     Обработчик событий мыши для выделения прямоугольников.
     """
     global drawing, start_point, end_point, current_rect, display_frame, zones, display_scale_factor, pending_zone_rect
-    
-    frame = display_frame.copy()
-    
-    # Рисуем уже созданные зоны (в масштабе отображения)
-    for zone_name, rect in zones.items():
-        (x1, y1), (x2, y2) = rect
-        
-        # Масштабируем координаты для отображения
-        if display_scale_factor != 1.0:
-            x1_display = int(x1 * display_scale_factor)
-            y1_display = int(y1 * display_scale_factor)
-            x2_display = int(x2 * display_scale_factor)
-            y2_display = int(y2 * display_scale_factor)
-        else:
-            x1_display, y1_display = x1, y1
-            x2_display, y2_display = x2, y2
-        
-        cv2.rectangle(frame, (x1_display, y1_display), (x2_display, y2_display), (0, 255, 0), 2)
-        # Добавляем название зоны
-        cv2.putText(frame, zone_name, (x1_display, y1_display - 10), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+    global _last_paint_ns
     
     if event == cv2.EVENT_LBUTTONDOWN:
         drawing = True
@@ -69,10 +62,16 @@ def mouse_callback(event, x, y, flags, param):
         end_point = (x, y)
     
     elif event == cv2.EVENT_MOUSEMOVE:
-        if drawing:
-            end_point = (x, y)
-            # Рисуем текущий прямоугольник
-            cv2.rectangle(frame, start_point, end_point, (255, 0, 0), 2)
+        if not drawing:
+            return
+        end_point = (x, y)
+        
+        # Мышь присылает события чаще частоты экрана: перерисовываем не чаще ~60 раз в секунду,
+        # пропущенное положение нарисует основной цикл на следующем waitKey
+        now = time.monotonic_ns()
+        if now - _last_paint_ns < MOUSE_REDRAW_INTERVAL_NS:
+            return
+        _last_paint_ns = now
     
     elif event == cv2.EVENT_LBUTTONUP:
         drawing = False
@@ -87,7 +86,87 @@ def mouse_callback(event, x, y, flags, param):
         end_point = None
     
     # Обновляем отображение
-    cv2.imshow('Настройка зон - Выделите прямоугольники мышкой', frame)
+    cv2.imshow(WINDOW_NAME, render_display_frame())
+
+
+def draw_zones(frame: np.ndarray):
+    """
+    Рисует все зоны (в масштабе отображения) на кадре.
+    """
+    for zone_name, rect in zones.items():
+        (x1, y1), (x2, y2) = rect
+        
+        # Масштабируем координаты для отображения
+        if display_scale_factor != 1.0:
+            x1_display = int(x1 * display_scale_factor)
+            y1_display = int(y1 * display_scale_factor)
+            x2_display = int(x2 * display_scale_factor)
+            y2_display = int(y2 * display_scale_factor)
+        else:
+            x1_display, y1_display = x1, y1
+            x2_display, y2_display = x2, y2
+        
+        cv2.rectangle(frame, (x1_display, y1_display), (x2_display, y2_display), ZONE_COLOR, 2)
+        # Добавляем название зоны
+        cv2.putText(frame, zone_name, (x1_display, y1_display - 10), 
+                   FONT, 0.7, ZONE_COLOR, 2)
+
+
+def invalidate_zones_overlay():
+    """
+    Сбрасывает кэш отрисованных зон (вызывается при добавлении, удалении и очистке зон).
+    """
+    global zones_overlay
+    zones_overlay = None
+
+
+def get_zones_overlay() -> np.ndarray:
+    """
+    Возвращает кадр отображения с зонами и подсказкой.
+    Кадр перерисовывается только после изменения зон, а не на каждой итерации цикла.
+    """
+    global zones_overlay
+    
+    if zones_overlay is None:
+        overlay = display_frame.copy()
+        draw_zones(overlay)
+        
+        # Добавляем подсказку
+        cv2.putText(overlay, HINT_TEXT, (10, overlay.shape[0] - 20), FONT, 0.6, HINT_COLOR, 2)
+        zones_overlay = overlay
+    
+    return zones_overlay
+
+
+def render_display_frame() -> np.ndarray:
+    """
+    Собирает кадр для вывода: кэшированные зоны и текущий прямоугольник.
+    Кадр собирается в заранее выделенном буфере без новых аллокаций на каждое событие мыши.
+    """
+    global scratch_frame
+    
+    overlay = get_zones_overlay()
+    if scratch_frame is None or scratch_frame.shape != overlay.shape:
+        scratch_frame = np.empty_like(overlay)
+    np.copyto(scratch_frame, overlay)
+    
+    # Рисуем текущий прямоугольник (если рисуем)
+    if drawing and start_point and end_point:
+        cv2.rectangle(scratch_frame, start_point, end_point, DRAWING_COLOR, 2)
+    
+    return scratch_frame
+
+
+def read_zone_name():
+    """
+    Читает название зоны из консоли в отдельном потоке и кладет его в input_queue.
+    """
+    try:
+        zone_name = input("Введите название зоны (или Enter для отмены): ").strip()
+    except (EOFError, KeyboardInterrupt):
+        print("\nОтменено")
+        zone_name = ""
+    input_queue.put(zone_name)
 
 
 def load_first_frame(video_path: str) -> Tuple[Optional[np.ndarray], Tuple[int, int]]:
@@ -102,9 +181,16 @@ def load_first_frame(video_path: str) -> Tuple[Optional[np.ndarray], Tuple[int,
         print(f"Ошибка: Не удалось открыть видео {video_path}")
         return None, (0, 0)
     
-    ret, frame = cap.read()
+    # Нужен ровно один кадр: не буферизуем лишние кадры в бэкенде,
+    # а после grab() забираем уже декодированный кадр через retrieve()
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
     original_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     original_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    
+    ret = cap.grab()
+    frame = None
+    if ret:
+        ret, frame = cap.retrieve()
     cap.release()
     
     if not ret:
@@ -126,8 +212,9 @@ def save_zones_json(zones: Dict, filename: str):
             "bottom_right": rect[1]
         }
     
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(zones_json, f, ensure_ascii=False, indent=2)
+    # orjson пишет UTF-8 (кириллица в названиях зон не экранируется)
+    with open(filename, 'wb') as f:
+        f.write(orjson.dumps(zones_json, option=orjson.OPT_INDENT_2))
     
     print(f"\nЗоны сохранены в {filename}")
 
@@ -147,25 +234,24 @@ def generate_python_code(zones: Dict) -> str:
     return "\n".join(lines)
 
 
-def scale_coordinates_to_original(coords: List[Tuple[int, int]], scale: float) -> List[Tuple[int, int]]:
+def scale_coordinates_to_original(coords: np.ndarray, scale: float) -> np.ndarray:
     """
     Масштабирует координаты обратно в исходное разрешение.
     
     Args:
-        coords: список координат в масштабированном разрешении
+        coords: массив координат (N, 2) в масштабированном разрешении
         scale: коэффициент масштабирования
     
     Returns:
-        Координаты в исходном разрешении
+        Массив координат (N, 2) int32 в исходном разрешении
     """
+    coords = np.asarray(coords)
     if scale == 1.0:
-        return coords
-    
-    scaled_coords = []
-    for (x, y) in coords:
-        scaled_coords.append((int(x / scale), int(y / scale)))
+        return coords.astype(np.int32, copy=False)
     
-    return scaled_coords
+    # Все точки пересчитываются одной векторной операцией; деление (а не умножение на 1/scale)
+    # дает те же целые координаты, что и прежний поточечный int(x / scale)
+    return (coords / scale).astype(np.int32)
 
 
 def load_zones_from_json(filename: str) -> Dict:
@@ -176,12 +262,14 @@ def load_zones_from_json(filename: str) -> Dict:
         return {}
     
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            zones_json = json.load(f)
+        with open(filename, 'rb') as f:
+            zones_json = orjson.loads(f.read())
         
         zones = {}
         for zone_name, coords in zones_json.items():
-            zones[zone_name] = [tuple(coords["top_left"]), tuple(coords["bottom_right"])]
+            # Нормализуем углы один раз при загрузке: (левый верхний, правый нижний)
+            (x1, y1), (x2, y2) = coords["top_left"], coords["bottom_right"]
+            zones[zone_name] = [(min(x1, x2), min(y1, y2)), (max(x1, x2), max(y1, y2))]
         
         return zones
     except Exception as e:
@@ -233,7 +321,7 @@ def main():
         display_scale = min(max_display_size / w, max_display_size / h)
         new_w = int(w * display_scale)
         new_h = int(h * display_scale)
-        display_frame = cv2.resize(frame.copy(), (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        display_frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_AREA)
         print(f"Кадр масштабирован для отображения: {w}x{h} -> {new_w}x{new_h}")
         print(f"Масштаб отображения: {display_scale:.3f}")
         if original_width > 0 and original_height > 0:
@@ -247,9 +335,8 @@ def main():
     original_video_size = original_size
     
     # Создаем окно и устанавливаем обработчик мыши
-    window_name = 'Настройка зон - Выделите прямоугольники мышкой'
-    cv2.namedWindow(window_name)
-    cv2.setMouseCallback(window_name, mouse_callback)
+    cv2.namedWindow(WINDOW_NAME)
+    cv2.setMouseCallback(WINDOW_NAME, mouse_callback)
     
     print("\n" + "="*60)
     print("ИНСТРУКЦИИ:")
@@ -264,10 +351,13 @@ def main():
     print("8. Нажмите 'c' для очистки всех зон")
     print("="*60 + "\n")
     
+    # Прямоугольник (в исходном разрешении), для которого ожидается название из консоли
+    awaiting_name_rect = None
+    
     # Основной цикл
     while True:
-        # Обрабатываем ожидающий прямоугольник
-        if pending_zone_rect is not None:
+        # Обрабатываем ожидающий прямоугольник (новый - только после ввода названия предыдущего)
+        if pending_zone_rect is not None and awaiting_name_rect is None:
             start_pt, end_pt = pending_zone_rect
             pending_zone_rect = None
             
@@ -276,71 +366,43 @@ def main():
             x2, y2 = max(start_pt[0], end_pt[0]), max(start_pt[1], end_pt[1])
             
             # Пересчитываем координаты в исходное разрешение, если было масштабирование
-            if display_scale_factor != 1.0:
-                x1_orig = int(x1 / display_scale_factor)
-                y1_orig = int(y1 / display_scale_factor)
-                x2_orig = int(x2 / display_scale_factor)
-                y2_orig = int(y2 / display_scale_factor)
-            else:
-                x1_orig, y1_orig = x1, y1
-                x2_orig, y2_orig = x2, y2
+            (x1_orig, y1_orig), (x2_orig, y2_orig) = scale_coordinates_to_original(
+                np.array([[x1, y1], [x2, y2]]), display_scale_factor
+            ).tolist()
             
-            # Запрашиваем название зоны
+            # Запрашиваем название зоны: input() читается в фоновом потоке,
+            # чтобы цикл продолжал вызывать waitKey и окно не копило события мыши
             print(f"\nВыделен прямоугольник: [{x1_orig}, {y1_orig}] -> [{x2_orig}, {y2_orig}]")
-            
-            # Даем время окну обработать события перед блокирующим input
-            cv2.waitKey(100)
-            
-            # Используем более безопасный способ ввода
+            awaiting_name_rect = [(x1_orig, y1_orig), (x2_orig, y2_orig)]
+            threading.Thread(target=read_zone_name, daemon=True).start()
+        
+        # Проверяем, введено ли название зоны
+        zone_name = None
+        if awaiting_name_rect is not None:
             try:
-                zone_name = input("Введите название зоны (или Enter для отмены): ").strip()
-            except (EOFError, KeyboardInterrupt):
-                print("\nОтменено")
-                zone_name = ""
+                zone_name = input_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+        if zone_name is not None:
+            (x1_orig, y1_orig), (x2_orig, y2_orig) = awaiting_name_rect
+            awaiting_name_rect = None
             
             # Пересоздаем окно если оно было закрыто
-            if not cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE) >= 1:
-                cv2.namedWindow(window_name)
-                cv2.setMouseCallback(window_name, mouse_callback)
+            if not cv2.getWindowProperty(WINDOW_NAME, cv2.WND_PROP_VISIBLE) >= 1:
+                cv2.namedWindow(WINDOW_NAME)
+                cv2.setMouseCallback(WINDOW_NAME, mouse_callback)
             
             if zone_name:
                 zones[zone_name] = [(x1_orig, y1_orig), (x2_orig, y2_orig)]
+                invalidate_zones_overlay()
                 print(f"Зона '{zone_name}' добавлена: [{x1_orig}, {y1_orig}] -> [{x2_orig}, {y2_orig}]")
             else:
                 print("Отменено")
         
-        # Обновляем отображение
-        frame_copy = display_frame.copy()
-        
-        # Рисуем все зоны (в масштабе отображения)
-        for zone_name, rect in zones.items():
-            (x1, y1), (x2, y2) = rect
-            
-            # Масштабируем координаты для отображения
-            if display_scale_factor != 1.0:
-                x1_display = int(x1 * display_scale_factor)
-                y1_display = int(y1 * display_scale_factor)
-                x2_display = int(x2 * display_scale_factor)
-                y2_display = int(y2 * display_scale_factor)
-            else:
-                x1_display, y1_display = x1, y1
-                x2_display, y2_display = x2, y2
-            
-            cv2.rectangle(frame_copy, (x1_display, y1_display), (x2_display, y2_display), (0, 255, 0), 2)
-            # Добавляем название зоны
-            cv2.putText(frame_copy, zone_name, (x1_display, y1_display - 10), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-        
-        # Рисуем текущий прямоугольник (если рисуем)
-        if drawing and start_point and end_point:
-            cv2.rectangle(frame_copy, start_point, end_point, (255, 0, 0), 2)
-        
-        # Добавляем подсказку
-        cv2.putText(frame_copy, "Нажмите 's' для сохранения, 'q' для выхода", 
-                   (10, frame_copy.shape[0] - 20), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-        
-        cv2.imshow(window_name, frame_copy)
+        # Обновляем отображение: зоны и подсказка берутся из кэша,
+        # на каждой итерации рисуется только текущий прямоугольник
+        cv2.imshow(WINDOW_NAME, render_display_frame())
         
         key = cv2.waitKey(1) & 0xFF
         
@@ -361,13 +423,15 @@ def main():
                 print("Нет зон для сохранения!")
         elif key == ord('d'):  # Удалить последнюю зону
             if zones:
-                last_zone = list(zones.keys())[-1]
+                last_zone = next(reversed(zones))
                 del zones[last_zone]
+                invalidate_zones_overlay()
                 print(f"Зона '{last_zone}' удалена")
             else:
                 print("Нет зон для удаления")
         elif key == ord('c'):  # Очистить все зоны
             zones.clear()
+            invalidate_zones_overlay()
             print("Все зоны очищены")
     
     cv2.destroyAllWindows()
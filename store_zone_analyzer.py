@@ -8,10 +8,13 @@ import cv2
 import numpy as np
 from ultralytics import YOLO
 from collections import defaultdict
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Iterator, List, Tuple, Optional
 import matplotlib.pyplot as plt
 import os
-import json
+import queue
+import threading
+import orjson
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont
 
 # ============================================================================
@@ -49,12 +52,14 @@ def load_zones_from_json(filename: str) -> Dict[str, List[Tuple[int, int]]]:
         return {}
     
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            zones_json = json.load(f)
+        with open(filename, 'rb') as f:
+            zones_json = orjson.loads(f.read())
         
         zones = {}
         for zone_name, coords in zones_json.items():
-            zones[zone_name] = [tuple(coords["top_left"]), tuple(coords["bottom_right"])]
+            # Нормализуем углы один раз при загрузке: (левый верхний, правый нижний)
+            (x1, y1), (x2, y2) = coords["top_left"], coords["bottom_right"]
+            zones[zone_name] = [(min(x1, x2), min(y1, y2)), (max(x1, x2), max(y1, y2))]
         
         return zones
     except Exception as e:
@@ -73,55 +78,117 @@ else:
 TARGET_WIDTH = 640
 TARGET_HEIGHT = 480
 FRAME_SKIP = 5  # Обрабатывать каждый N-й кадр для ускорения
+DECODE_QUEUE_SIZE = 32  # Сколько подготовленных кадров декодер может держать впереди трекинга
+VIDEO_HW_ACCELERATION = True  # Пытаться декодировать видео аппаратно (без поддержки - обычное декодирование)
 
 # Параметры для объединения повторных посетителей
 MERGE_TRACKS_ENABLED = True  # Включить объединение повторных треков
 MAX_TRACK_GAP_SECONDS = 30.0  # Максимальный разрыв между треками для объединения (секунды)
 SIMILAR_SIZE_THRESHOLD = 0.3  # Порог схожести размера bbox для объединения (30%)
 
+# Модель YOLOv8 (nano версия для CPU, автоматически скачается при первом запуске).
+# Можно указать экспортированную модель OpenVINO (папку *_openvino_model) - на CPU Intel она быстрее PyTorch
+MODEL_PATH = os.getenv("YOLO_MODEL_PATH", "yolov8n.pt")
+
 # Путь для сохранения результата
 OUTPUT_IMAGE_PATH = "zone_analysis_result.png"
+SAVE_VISUALIZATION = True  # Сохранять визуализацию в файл (False - только статистика в консоли)
+OUTPUT_PNG_COMPRESSION = 1  # Уровень сжатия PNG (0-9): 1 кодирует в разы быстрее, файл чуть больше
+ANONYMIZE_DOWNSCALE = 8  # Во сколько раз уменьшается область с человеком при размытии (152-ФЗ)
+
+# Цвета границ зон на визуализации, назначаются зонам по порядку
+ZONE_BORDER_COLORS = (
+    (0, 255, 0),      # Зеленый
+    (255, 0, 0),      # Синий
+    (255, 0, 255),    # Пурпурный
+    (0, 255, 255),    # Желтый
+    (255, 165, 0),    # Оранжевый
+    (128, 0, 128),    # Фиолетовый
+)
+
+# Статистика зоны, в которой никого не было
+EMPTY_ZONE_STATS = {"total_time": 0, "avg_time": 0, "visitor_count": 0}
 
 
 # ============================================================================
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 # ============================================================================
 
-def point_in_rect(point: Tuple[int, int], rect: Tuple[Tuple[int, int], Tuple[int, int]]) -> bool:
+@lru_cache(maxsize=1)
+def get_model() -> YOLO:
+    """Возвращает модель для трекинга (загружается один раз на процесс)."""
+    print(f"Загрузка модели {MODEL_PATH}...")
+    return YOLO(MODEL_PATH, task="detect")
+
+
+@lru_cache(maxsize=1)
+def get_detection_model() -> YOLO:
+    """
+    Возвращает модель для детекции при анонимизации (загружается один раз на процесс).
+    
+    Отдельный экземпляр нужен потому, что после model.track() к предиктору модели
+    трекинга подключен трекер и обычный вызов model() вернул бы только подтвержденные треки.
+    """
+    return YOLO(MODEL_PATH, task="detect")
+
+
+def reset_tracker(model: YOLO):
+    """Сбрасывает состояние трекера, оставшееся от предыдущего видео."""
+    predictor = getattr(model, "predictor", None)
+    for tracker in getattr(predictor, "trackers", None) or []:
+        tracker.reset()
+
+
+def zones_to_array(zones: Dict[str, List[Tuple[int, int]]]) -> np.ndarray:
     """
-    Проверяет, находится ли точка внутри прямоугольника.
+    Преобразует зоны в массив прямоугольников для векторной проверки попадания.
     
     Args:
-        point: (x, y) координаты точки
-        rect: ((x1, y1), (x2, y2)) координаты прямоугольника
+        zones: словарь зон {name: [(x1, y1), (x2, y2)]}
     
     Returns:
-        True если точка внутри прямоугольника
+        Массив (Z, 4) int32 [x_min, y_min, x_max, y_max] в порядке zones
     """
-    x, y = point
-    (x1, y1), (x2, y2) = rect
+    # Углы нормализуются: x1 < x2 и y1 < y2
+    return np.array([
+        [min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)]
+        for (x1, y1), (x2, y2) in zones.values()
+    ], dtype=np.int32).reshape(-1, 4)
+
+
+def which_zones(points: np.ndarray, zones_arr: np.ndarray) -> np.ndarray:
+    """
+    Проверяет попадание всех точек во все зоны одной векторной операцией.
     
-    # Убеждаемся, что x1 < x2 и y1 < y2
-    min_x, max_x = min(x1, x2), max(x1, x2)
-    min_y, max_y = min(y1, y2), max(y1, y2)
+    Args:
+        points: массив (N, 2) координат точек (x, y)
+        zones_arr: массив (Z, 4) зон из zones_to_array()
     
-    return min_x <= x <= max_x and min_y <= y <= max_y
+    Returns:
+        Булев массив (N, Z): True если точка внутри зоны (границы включаются)
+    """
+    x = points[:, 0:1]
+    y = points[:, 1:2]
+    return (
+        (zones_arr[:, 0] <= x) & (x <= zones_arr[:, 2]) &
+        (zones_arr[:, 1] <= y) & (y <= zones_arr[:, 3])
+    )
 
 
-def get_bbox_center(bbox: np.ndarray) -> Tuple[int, int]:
+def bbox_centers(bboxes: np.ndarray) -> np.ndarray:
     """
-    Вычисляет центр bounding box.
+    Вычисляет центры всех bounding box одной векторной операцией.
     
     Args:
-        bbox: массив [x1, y1, x2, y2]
+        bboxes: массив (N, 4+) [x1, y1, x2, y2, ...]
     
     Returns:
-        (center_x, center_y)
+        Массив (N, 2) int32 (center_x, center_y)
     """
-    x1, y1, x2, y2 = bbox[:4]
-    center_x = int((x1 + x2) / 2)
-    center_y = int((y1 + y2) / 2)
-    return center_x, center_y
+    corners_sum = bboxes[:, :2] + bboxes[:, 2:4]
+    if bboxes.dtype.kind == 'i':
+        return (corners_sum >> 1).astype(np.int32, copy=False)
+    return (corners_sum * 0.5).astype(np.int32)
 
 
 def resize_frame_if_needed(frame: np.ndarray, target_width: int, target_height: int) -> Tuple[np.ndarray, float]:
@@ -164,25 +231,137 @@ def scale_zones(zones: Dict[str, List[Tuple[int, int]]], scale: float) -> Dict[s
     Returns:
         Масштабированные зоны
     """
-    scaled_zones = {}
-    for zone_name, rect in zones.items():
-        scaled_zones[zone_name] = [
-            (int(rect[0][0] * scale), int(rect[0][1] * scale)),
-            (int(rect[1][0] * scale), int(rect[1][1] * scale))
-        ]
-    return scaled_zones
+    # Все углы всех зон масштабируются одной операцией над массивом (Z, 2, 2);
+    # float64 и отбрасывание дробной части дают те же значения, что int(x * scale)
+    corners = np.array(list(zones.values()), dtype=np.float64).reshape(-1, 2, 2)
+    scaled_corners = (corners * scale).astype(np.int32).tolist()
+    
+    return {
+        zone_name: [tuple(top_left), tuple(bottom_right)]
+        for zone_name, (top_left, bottom_right) in zip(zones.keys(), scaled_corners)
+    }
+
+
+def open_video(video_path: str) -> cv2.VideoCapture:
+    """
+    Открывает видео, по возможности с аппаратным декодированием (VAAPI, D3D11, NVDEC и т.п.).
+    
+    Кадры в любом случае возвращаются как обычные массивы numpy.
+    Если сборка OpenCV или система не поддерживает ускорение, используется программный декодер.
+    """
+    if VIDEO_HW_ACCELERATION:
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG,
+                               [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        if cap.isOpened():
+            return cap
+        cap.release()
+    
+    return cv2.VideoCapture(video_path)
+
+
+class FrameReader:
+    """
+    Читает кадры видео в фоновом потоке, пропускает лишние (FRAME_SKIP) и ресайзит оставшиеся.
+    
+    Декодирование и ресайз (OpenCV отпускает GIL) идут параллельно с трекингом в основном потоке.
+    Кадры пишутся в кольцо из DECODE_QUEUE_SIZE + 2 заранее выделенных буферов: буфер не
+    перезаписывается, пока кадр лежит в очереди или обрабатывается потребителем.
+    """
+    
+    def __init__(self, cap: cv2.VideoCapture, frame_shape: Tuple[int, ...],
+                 resized_size: Optional[Tuple[int, int]] = None):
+        """
+        Args:
+            cap: открытое видео, позиция - начало
+            frame_shape: форма исходного кадра (высота, ширина, каналы)
+            resized_size: (ширина, высота) для ресайза или None, если ресайз не нужен
+        """
+        self.cap = cap
+        self.frame_count = 0  # Сколько всего кадров прочитано из видео
+        self._resized_size = resized_size
+        
+        output_shape = frame_shape if resized_size is None else (resized_size[1], resized_size[0]) + tuple(frame_shape[2:])
+        self._buffers = [np.empty(output_shape, dtype=np.uint8) for _ in range(DECODE_QUEUE_SIZE + 2)]
+        self._read_buffer = np.empty(frame_shape, dtype=np.uint8) if resized_size is not None else None
+        
+        self._queue = queue.Queue(maxsize=DECODE_QUEUE_SIZE)
+        self._stop = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def _put(self, item) -> bool:
+        """Кладет элемент в очередь, не блокируясь навсегда после остановки."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _run(self):
+        """Поток декодирования: (номер кадра, кадр) в очередь, в конце - None."""
+        try:
+            out_index = 0
+            while not self._stop.is_set():
+                if not self.cap.grab():
+                    break
+                
+                self.frame_count += 1
+                
+                # Пропускаем кадры для ускорения: для них достаточно grab(),
+                # конвертация в BGR и копирование кадра (retrieve) нужны только обрабатываемым
+                if self.frame_count % FRAME_SKIP != 0:
+                    continue
+                
+                target = self._read_buffer if self._resized_size is not None else self._buffers[out_index]
+                ret, frame = self.cap.retrieve(image=target)
+                if not ret:
+                    break
+                
+                # Ресайз кадра для оптимизации (scale уже определен)
+                if self._resized_size is not None:
+                    frame = cv2.resize(frame, self._resized_size, dst=self._buffers[out_index],
+                                       interpolation=cv2.INTER_LINEAR)
+                
+                out_index = (out_index + 1) % len(self._buffers)
+                if not self._put((self.frame_count, frame)):
+                    break
+        except Exception as e:
+            self._error = e
+        finally:
+            self._put(None)
+    
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray]]:
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                yield item
+        finally:
+            self.close()
+    
+    def close(self):
+        """Останавливает поток декодирования и дожидается его завершения."""
+        self._stop.set()
+        self._thread.join()
 
 
 # ============================================================================
 # ОСНОВНАЯ ЛОГИКА ОБРАБОТКИ
 # ============================================================================
 
-def process_video(video_path: str) -> Tuple[Dict, Optional[np.ndarray], float, Dict, Dict]:
+def process_video(video_path: str, zones: Optional[Dict[str, List[Tuple[int, int]]]] = None) -> Tuple[Dict, Optional[np.ndarray], float, Dict, Dict]:
     """
     Обрабатывает видео и собирает статистику по зонам.
     
     Args:
         video_path: путь к видеофайлу
+        zones: зоны для анализа (по умолчанию используются ZONES)
     
     Returns:
         Кортеж (zone_statistics, last_frame, scale, scaled_zones, track_merges)
@@ -195,7 +374,7 @@ def process_video(video_path: str) -> Tuple[Dict, Optional[np.ndarray], float, D
     print(f"Загрузка видео: {video_path}")
     
     # Открываем видео
-    cap = cv2.VideoCapture(video_path)
+    cap = open_video(video_path)
     if not cap.isOpened():
         raise ValueError(f"Не удалось открыть видео: {video_path}")
     
@@ -216,14 +395,20 @@ def process_video(video_path: str) -> Tuple[Dict, Optional[np.ndarray], float, D
     
     cap.set(cv2.CAP_PROP_POS_FRAMES, 0)  # Возвращаемся к началу
     
+    frame_shape = first_frame.shape
     first_frame, scale = resize_frame_if_needed(first_frame, TARGET_WIDTH, TARGET_HEIGHT)
-    scaled_zones = scale_zones(ZONES, scale)
+    resized_size = (first_frame.shape[1], first_frame.shape[0]) if scale != 1.0 else None
+    scaled_zones = scale_zones(ZONES if zones is None else zones, scale)
+    
+    # Зоны в виде массива для проверки попадания сразу всех людей на кадре
+    zone_names = list(scaled_zones.keys())
+    zones_arr = zones_to_array(scaled_zones)
     
     print(f"Масштаб видео: {scale:.3f}")
     
-    # Инициализация YOLOv8 модели (nano версия для CPU)
-    print("Загрузка модели YOLOv8n...")
-    model = YOLO('yolov8n.pt')  # Автоматически скачает при первом запуске
+    # Модель общая для всех видео в процессе, трекер начинает с чистого состояния
+    model = get_model()
+    reset_tracker(model)
     
     # Структура для хранения статистики: {zone_name: {track_id: [(start_time, end_time), ...]}}
     zone_statistics = defaultdict(lambda: defaultdict(list))
@@ -232,170 +417,162 @@ def process_video(video_path: str) -> Tuple[Dict, Optional[np.ndarray], float, D
     current_state = defaultdict(dict)
     
     # История треков для объединения повторных посетителей
-    # {track_id: {"last_seen": time, "last_bbox": bbox, "last_center": center, "last_zones": zones, "bbox_size": size}}
+    # {track_id: {"last_seen": time, "last_zones": zones, "bbox_size": size}}
     track_history = {}
     
     # Маппинг объединенных треков: {new_track_id: original_track_id}
     track_merges = {}
     
+    # Сообщения об объединении треков выводятся одним блоком после обработки, а не из цикла
+    merge_log = []
+    
     # Для хранения последнего кадра
     last_frame = None
     
-    frame_count = 0
     processed_frames = 0
     
     print("Начало обработки видео...")
     
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        frame_count += 1
-        
-        # Пропускаем кадры для ускорения
-        if frame_count % FRAME_SKIP != 0:
-            continue
-        
-        processed_frames += 1
-        
-        # Ресайз кадра для оптимизации (scale уже определен)
-        frame, _ = resize_frame_if_needed(frame, TARGET_WIDTH, TARGET_HEIGHT)
-        
-        # Обновляем последний кадр
-        last_frame = frame.copy()
-        
-        # Вычисляем текущее время
-        current_time = frame_count * frame_time
-        
-        # Трекинг людей
-        results = model.track(frame, persist=True, classes=[0], verbose=False)  # class 0 = person
-        
-        # Обрабатываем результаты трекинга
-        if results[0].boxes is not None and len(results[0].boxes) > 0:
-            boxes = results[0].boxes
+    # Кадры читаются, прореживаются и ресайзятся в отдельном потоке,
+    # пока основной поток занят трекингом предыдущих кадров
+    frame_reader = FrameReader(cap, frame_shape, resized_size)
+    
+    # Если тело цикла бросит исключение (например, в модели), генератор закроется только сборщиком мусора:
+    # закрываем чтение явно, чтобы поток декодирования остановился и видео освободилось
+    try:
+        for frame_count, frame in frame_reader:
+            processed_frames += 1
             
-            # Получаем track_id (если доступны)
-            track_ids = boxes.id.cpu().numpy() if boxes.id is not None else None
+            # Обновляем последний кадр (без копирования: буфер кольца не перезаписывается, пока кадр у потребителя)
+            last_frame = frame
             
-            for idx, box in enumerate(boxes):
-                bbox = box.xyxy[0].cpu().numpy()
-                
-                # Получаем центр bounding box
-                center = get_bbox_center(bbox)
-                
-                # Определяем, в каких зонах находится центр (используем масштабированные зоны)
-                zones = []
-                for zone_name, rect in scaled_zones.items():
-                    if point_in_rect(center, rect):
-                        zones.append(zone_name)
-                
-                # Получаем track_id
-                track_id = int(track_ids[idx]) if track_ids is not None else idx
-                
-                # Вычисляем размер bbox для сравнения
-                bbox_width = bbox[2] - bbox[0]
-                bbox_height = bbox[3] - bbox[1]
-                bbox_size = bbox_width * bbox_height
-                
-                # Попытка объединения с предыдущими треками (если включено)
-                if MERGE_TRACKS_ENABLED and track_id not in track_history:
-                    # Ищем похожий трек, который недавно закончился
-                    for old_track_id, old_info in track_history.items():
-                        if old_track_id == track_id:
-                            continue
-                        
-                        time_gap = current_time - old_info["last_seen"]
-                        
-                        # Проверяем временной разрыв
-                        if time_gap > MAX_TRACK_GAP_SECONDS:
-                            continue
-                        
-                        # Проверяем размер bbox (рост человека примерно одинаковый)
-                        old_size = old_info.get("bbox_size", 0)
-                        if old_size > 0:
-                            size_ratio = min(bbox_size, old_size) / max(bbox_size, old_size)
-                            if size_ratio < (1.0 - SIMILAR_SIZE_THRESHOLD):
-                                continue  # Размеры слишком разные
-                        
-                        # Проверяем, были ли в похожих зонах
-                        old_zones = old_info.get("last_zones", [])
-                        if zones and old_zones:
-                            # Если оба были в зонах и зоны пересекаются - вероятно тот же человек
-                            if set(zones) & set(old_zones):
-                                # Объединяем треки
-                                merged_track_id = track_merges.get(old_track_id, old_track_id)
-                                track_merges[track_id] = merged_track_id
-                                track_id = merged_track_id
-                                print(f"Объединены треки: {old_track_id} -> {merged_track_id} (разрыв {time_gap:.1f}с)")
-                                break
+            # Вычисляем текущее время
+            current_time = frame_count * frame_time
+            
+            # Трекинг людей
+            results = model.track(frame, persist=True, classes=[0], verbose=False)  # class 0 = person
+            
+            # Обрабатываем результаты трекинга
+            track_ids = None
+            if results[0].boxes is not None and len(results[0].boxes) > 0:
+                boxes = results[0].boxes
                 
-                # Обновляем историю трека
-                track_history[track_id] = {
-                    "last_seen": current_time,
-                    "last_bbox": bbox.copy(),
-                    "last_center": center,
-                    "last_zones": zones.copy(),
-                    "bbox_size": bbox_size
-                }
+                # Данные всех боксов забираем с устройства одним вызовом на массив, а не на каждый бокс
+                # Получаем track_id (если доступны)
+                track_ids = boxes.id.cpu().numpy().astype(int).tolist() if boxes.id is not None else None
                 
-                # Обновляем состояние для всех зон, в которых был посетитель
-                active_zones = set(zones)
-                previous_zones = set(current_state.get(track_id, {}).keys())
+                bboxes = boxes.xyxy.cpu().numpy()
                 
-                # Зоны, которые посетитель покинул
-                exited_zones = previous_zones - active_zones
+                # Вычисляем размеры bbox для сравнения (сразу для всех)
+                bbox_sizes = ((bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])).tolist()
                 
-                # Зоны, в которые посетитель вошел
-                entered_zones = active_zones - previous_zones
+                # Получаем центры bounding box
+                centers = bbox_centers(bboxes)
                 
-                # Зоны, в которых посетитель остался
-                stayed_zones = active_zones & previous_zones
+                # Определяем, в каких зонах находятся центры (используем масштабированные зоны):
+                # одна проверка (N, Z) на весь кадр вместо вызова на каждую пару человек-зона
+                zone_hits = which_zones(centers, zones_arr)
                 
-                # Закрываем интервалы для зон, которые покинули
-                for zone_name in exited_zones:
-                    start_time = current_state[track_id][zone_name]
-                    zone_statistics[zone_name][track_id].append((start_time, current_time))
-                    del current_state[track_id][zone_name]
+                for idx in range(len(bboxes)):
+                    track_zones = [zone_names[zone_idx] for zone_idx in np.flatnonzero(zone_hits[idx])]
+                    
+                    # Получаем track_id
+                    track_id = track_ids[idx] if track_ids is not None else idx
+                    
+                    bbox_size = bbox_sizes[idx]
+                    
+                    # Попытка объединения с предыдущими треками (если включено)
+                    if MERGE_TRACKS_ENABLED and track_id not in track_history:
+                        # Ищем похожий трек, который недавно закончился
+                        for old_track_id, old_info in track_history.items():
+                            if old_track_id == track_id:
+                                continue
+                            
+                            time_gap = current_time - old_info["last_seen"]
+                            
+                            # Проверяем временной разрыв
+                            if time_gap > MAX_TRACK_GAP_SECONDS:
+                                continue
+                            
+                            # Проверяем размер bbox (рост человека примерно одинаковый)
+                            old_size = old_info.get("bbox_size", 0)
+                            if old_size > 0:
+                                size_ratio = min(bbox_size, old_size) / max(bbox_size, old_size)
+                                if size_ratio < (1.0 - SIMILAR_SIZE_THRESHOLD):
+                                    continue  # Размеры слишком разные
+                            
+                            # Проверяем, были ли в похожих зонах
+                            old_zones = old_info.get("last_zones", [])
+                            if track_zones and old_zones:
+                                # Если оба были в зонах и зоны пересекаются - вероятно тот же человек
+                                if set(track_zones) & set(old_zones):
+                                    # Объединяем треки
+                                    merged_track_id = track_merges.get(old_track_id, old_track_id)
+                                    track_merges[track_id] = merged_track_id
+                                    track_id = merged_track_id
+                                    merge_log.append(f"Объединены треки: {old_track_id} -> {merged_track_id} (разрыв {time_gap:.1f}с)")
+                                    break
+                    
+                    # Обновляем историю трека (только поля, которые читает поиск треков для объединения;
+                    # track_zones создается заново для каждого бокса, копировать его не нужно)
+                    track_history[track_id] = {
+                        "last_seen": current_time,
+                        "last_zones": track_zones,
+                        "bbox_size": bbox_size
+                    }
+                    
+                    # Обновляем состояние для всех зон, в которых был посетитель:
+                    # переходы считаются по словарю открытых интервалов без построения множеств
+                    previous_state = current_state.get(track_id)
+                    
+                    # Закрываем интервалы для зон, которые посетитель покинул
+                    if previous_state:
+                        for zone_name in [name for name in previous_state if name not in track_zones]:
+                            start_time = previous_state.pop(zone_name)
+                            zone_statistics[zone_name][track_id].append((start_time, current_time))
+                    
+                    # Начинаем новые интервалы для зон, в которые вошли
+                    # (setdefault не трогает уже открытые интервалы)
+                    for zone_name in track_zones:
+                        current_state[track_id].setdefault(zone_name, current_time)
+                    
+                    # Для зон, в которых остались, ничего не делаем (интервал продолжается)
+            
+            # Закрываем интервалы для треков, которые больше не видны
+            if frame_count % (FRAME_SKIP * 10) == 0:  # Проверяем каждые 10 обработанных кадров
+                active_track_ids = set(track_ids) if track_ids is not None else set()
                 
-                # Начинаем новые интервалы для зон, в которые вошли
-                for zone_name in entered_zones:
-                    current_state[track_id][zone_name] = current_time
+                # Очищаем старую историю треков (старше MAX_TRACK_GAP_SECONDS)
+                tracks_to_remove = []
+                for old_track_id, old_info in track_history.items():
+                    if current_time - old_info["last_seen"] > MAX_TRACK_GAP_SECONDS:
+                        tracks_to_remove.append(old_track_id)
+                for old_track_id in tracks_to_remove:
+                    del track_history[old_track_id]
                 
-                # Для зон, в которых остались, ничего не делаем (интервал продолжается)
-        
-        # Закрываем интервалы для треков, которые больше не видны
-        if frame_count % (FRAME_SKIP * 10) == 0:  # Проверяем каждые 10 обработанных кадров
-            active_track_ids = set()
-            if results[0].boxes is not None and results[0].boxes.id is not None:
-                active_track_ids = set(results[0].boxes.id.cpu().numpy().astype(int))
+                for track_id in list(current_state.keys()):
+                    if track_id not in active_track_ids:
+                        # Трек больше не активен, закрываем все его интервалы
+                        for zone_name, start_time in current_state[track_id].items():
+                            zone_statistics[zone_name][track_id].append((start_time, current_time))
+                        del current_state[track_id]
             
-            # Очищаем старую историю треков (старше MAX_TRACK_GAP_SECONDS)
-            tracks_to_remove = []
-            for old_track_id, old_info in track_history.items():
-                if current_time - old_info["last_seen"] > MAX_TRACK_GAP_SECONDS:
-                    tracks_to_remove.append(old_track_id)
-            for old_track_id in tracks_to_remove:
-                del track_history[old_track_id]
-            
-            for track_id in list(current_state.keys()):
-                if track_id not in active_track_ids:
-                    # Трек больше не активен, закрываем все его интервалы
-                    for zone_name, start_time in current_state[track_id].items():
-                        zone_statistics[zone_name][track_id].append((start_time, current_time))
-                    del current_state[track_id]
-        
-        # Прогресс
-        if processed_frames % 10 == 0:
-            print(f"Обработано кадров: {processed_frames} (кадр {frame_count} из видео)")
+            # Прогресс
+            if processed_frames % 10 == 0:
+                print(f"Обработано кадров: {processed_frames} (кадр {frame_count} из видео)")
+    finally:
+        frame_reader.close()
+        cap.release()
     
     # Закрываем все оставшиеся интервалы
+    frame_count = frame_reader.frame_count
     final_time = frame_count * frame_time
     for track_id, zones_dict in current_state.items():
         for zone_name, start_time in zones_dict.items():
             zone_statistics[zone_name][track_id].append((start_time, final_time))
     
-    cap.release()
+    if merge_log:
+        print("\n".join(merge_log))
     print(f"Обработка завершена. Всего обработано кадров: {processed_frames}")
     
     return zone_statistics, last_frame, scale, scaled_zones, track_merges
@@ -414,31 +591,21 @@ def calculate_statistics(zone_statistics: Dict, track_merges: Dict = None) -> Di
     result = {}
     
     for zone_name, tracks_data in zone_statistics.items():
-        total_time = 0.0
+        # Суммарное время - по всем интервалам зоны одной векторной операцией
+        # (объединение треков на сумму не влияет, только на число посетителей)
+        intervals = np.array(
+            [interval for track_intervals in tracks_data.values() for interval in track_intervals],
+            dtype=np.float64
+        ).reshape(-1, 2)
+        total_time = float((intervals[:, 1] - intervals[:, 0]).sum())
         
         if track_merges:
-            # Объединяем треки, которые были объединены
-            merged_tracks = {}
-            for track_id, intervals in tracks_data.items():
-                # Используем оригинальный track_id если был объединен
-                original_id = track_merges.get(track_id, track_id)
-                if original_id not in merged_tracks:
-                    merged_tracks[original_id] = []
-                merged_tracks[original_id].extend(intervals)
-            
-            # Суммируем время для всех уникальных треков (после объединения)
-            for track_id, intervals in merged_tracks.items():
-                for start_time, end_time in intervals:
-                    total_time += (end_time - start_time)
-            
-            # Количество уникальных посетителей (после объединения)
-            visitor_count = len(merged_tracks)
+            # Количество уникальных посетителей (после объединения):
+            # объединенные треки считаются по оригинальному track_id
+            visitor_count = len({track_merges.get(track_id, track_id) for track_id in tracks_data})
         else:
             # Без объединения - считаем как раньше
             visitor_count = len(tracks_data)
-            for track_id, intervals in tracks_data.items():
-                for start_time, end_time in intervals:
-                    total_time += (end_time - start_time)
         
         # Среднее время на посетителя
         avg_time = total_time / visitor_count if visitor_count > 0 else 0.0
@@ -478,6 +645,52 @@ def print_statistics(stats: Dict[str, Dict]):
     print("="*80 + "\n")
 
 
+@lru_cache(maxsize=1)
+def get_fonts() -> Tuple[ImageFont.ImageFont, ImageFont.ImageFont]:
+    """
+    Возвращает шрифты с поддержкой кириллицы (заголовок 20 и текст 16), загружаемые один раз на процесс.
+    
+    Returns:
+        Кортеж (font, font_small)
+    """
+    try:
+        # Пробуем стандартные шрифты Windows
+        font_paths = [
+            "C:/Windows/Fonts/arial.ttf",
+            "C:/Windows/Fonts/calibri.ttf",
+            "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",  # Linux
+            "/System/Library/Fonts/Helvetica.ttc",  # macOS
+        ]
+        for path in font_paths:
+            if os.path.exists(path):
+                try:
+                    return ImageFont.truetype(path, 20), ImageFont.truetype(path, 16)
+                except:
+                    continue
+    except:
+        pass
+    
+    return ImageFont.load_default(), ImageFont.load_default()
+
+
+@lru_cache(maxsize=1)
+def get_heat_colors() -> Tuple[Tuple[int, int, int], ...]:
+    """
+    Возвращает таблицу из 256 цветов RGB карты 'hot' для тепловой карты.
+    
+    Индекс min(int(intensity * 256), 255) дает тот же цвет, что и colors(intensity) у matplotlib.
+    """
+    try:
+        # Для новых версий matplotlib (>=3.5)
+        colors = plt.colormaps['hot']
+    except (AttributeError, KeyError):
+        # Для старых версий matplotlib
+        colors = plt.cm.get_cmap('hot')
+    
+    lut = (colors(np.arange(256))[:, :3] * 255).astype(np.uint8)
+    return tuple(tuple(color) for color in lut.tolist())
+
+
 def anonymize_frame(frame: np.ndarray, model: YOLO) -> np.ndarray:
     """
     Размывает людей на кадре для соблюдения 152-ФЗ.
@@ -501,11 +714,14 @@ def anonymize_frame(frame: np.ndarray, model: YOLO) -> np.ndarray:
             bbox = box.xyxy[0].cpu().numpy()
             x1, y1, x2, y2 = map(int, bbox[:4])
             
-            # Размываем область с человеком
+            # Размываем область с человеком: уменьшение с усреднением и обратное увеличение
+            # стирают детали не хуже GaussianBlur 51x51, но обрабатывают в разы меньше пикселей
             roi = anonymized_frame[y1:y2, x1:x2]
             if roi.size > 0:
-                blurred_roi = cv2.GaussianBlur(roi, (51, 51), 0)
-                anonymized_frame[y1:y2, x1:x2] = blurred_roi
+                roi_h, roi_w = roi.shape[:2]
+                small_size = (max(1, roi_w // ANONYMIZE_DOWNSCALE), max(1, roi_h // ANONYMIZE_DOWNSCALE))
+                small = cv2.resize(roi, small_size, interpolation=cv2.INTER_AREA)
+                anonymized_frame[y1:y2, x1:x2] = cv2.resize(small, (roi_w, roi_h), interpolation=cv2.INTER_LINEAR)
     
     return anonymized_frame
 
@@ -524,8 +740,7 @@ def create_visualization(frame: np.ndarray, stats: Dict[str, Dict], zone_statist
         Кадр с визуализацией
     """
     # Анонимизируем кадр
-    model = YOLO('yolov8n.pt')
-    anonymized_frame = anonymize_frame(frame, model)
+    anonymized_frame = anonymize_frame(frame, get_detection_model())
     
     # Создаем overlay для визуализации
     overlay = anonymized_frame.copy()
@@ -534,71 +749,28 @@ def create_visualization(frame: np.ndarray, stats: Dict[str, Dict], zone_statist
     # Находим максимальное суммарное время для нормализации
     max_time = max([data["total_time"] for data in stats.values()], default=1.0)
     
-    # Создаем цветовую карту для тепловой карты
-    try:
-        # Для новых версий matplotlib (>=3.5)
-        colors = plt.colormaps['hot']
-    except (AttributeError, KeyError):
-        # Для старых версий matplotlib
-        colors = plt.cm.get_cmap('hot')
+    # Цвета тепловой карты и шрифты загружаются один раз на процесс
+    heat_colors = get_heat_colors()
+    font, font_small = get_fonts()
     
     # Конвертируем в PIL для работы с кириллицей
     overlay_rgb = cv2.cvtColor(overlay, cv2.COLOR_BGR2RGB)
     pil_image = Image.fromarray(overlay_rgb)
     draw = ImageDraw.Draw(pil_image, 'RGBA')
     
-    # Пытаемся загрузить шрифт с поддержкой кириллицы
-    try:
-        # Пробуем стандартные шрифты Windows
-        font_paths = [
-            "C:/Windows/Fonts/arial.ttf",
-            "C:/Windows/Fonts/calibri.ttf",
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",  # Linux
-            "/System/Library/Fonts/Helvetica.ttc",  # macOS
-        ]
-        font = None
-        for path in font_paths:
-            if os.path.exists(path):
-                try:
-                    font = ImageFont.truetype(path, 20)
-                    font_small = ImageFont.truetype(path, 16)
-                    break
-                except:
-                    continue
-        if font is None:
-            font = ImageFont.load_default()
-            font_small = ImageFont.load_default()
-    except:
-        font = ImageFont.load_default()
-        font_small = ImageFont.load_default()
-    
-    # Генерируем уникальные цвета для зон
-    zone_colors_list = [
-        (0, 255, 0),      # Зеленый
-        (255, 0, 0),      # Синий
-        (255, 0, 255),    # Пурпурный
-        (0, 255, 255),    # Желтый
-        (255, 165, 0),    # Оранжевый
-        (128, 0, 128),    # Фиолетовый
-    ]
-    zone_colors = {}
-    for idx, (zone_name, _) in enumerate(scaled_zones.items()):
-        zone_colors[zone_name] = zone_colors_list[idx % len(zone_colors_list)]
-    
-    # Рисуем зоны
-    for zone_name, rect in scaled_zones.items():
+    # Рисуем зоны (цвет границы - по порядку зоны из палитры ZONE_BORDER_COLORS)
+    for zone_idx, (zone_name, rect) in enumerate(scaled_zones.items()):
         (x1, y1), (x2, y2) = rect
         
         # Получаем статистику для этой зоны
-        zone_stat = stats.get(zone_name, {"total_time": 0, "avg_time": 0, "visitor_count": 0})
+        zone_stat = stats.get(zone_name, EMPTY_ZONE_STATS)
         intensity = zone_stat["total_time"] / max_time if max_time > 0 else 0
         
         # Цвет для тепловой карты (красный = больше времени)
-        heat_color = colors(intensity)[:3]
-        heat_color_rgba = tuple(int(c * 255) for c in heat_color) + (128,)  # 50% прозрачность
+        heat_color_rgba = heat_colors[min(int(intensity * 256), 255)] + (128,)  # 50% прозрачность
         
         # Цвет для границы зоны
-        zone_color = zone_colors.get(zone_name, (128, 128, 128))
+        zone_color = ZONE_BORDER_COLORS[zone_idx % len(ZONE_BORDER_COLORS)]
         
         # Полупрозрачный overlay для тепловой карты
         draw.rectangle([x1, y1, x2, y2], fill=heat_color_rgba)
@@ -722,13 +894,14 @@ def main():
         # Выводим статистику
         print_statistics(stats)
         
-        # Создаем визуализацию
-        print("Создание визуализации...")
-        visualization = create_visualization(last_frame, stats, zone_statistics, scaled_zones)
-        
-        # Сохраняем результат
-        cv2.imwrite(OUTPUT_IMAGE_PATH, visualization)
-        print(f"Визуализация сохранена: {OUTPUT_IMAGE_PATH}")
+        if SAVE_VISUALIZATION:
+            # Создаем визуализацию
+            print("Создание визуализации...")
+            visualization = create_visualization(last_frame, stats, zone_statistics, scaled_zones)
+            
+            # Сохраняем результат
+            cv2.imwrite(OUTPUT_IMAGE_PATH, visualization, [cv2.IMWRITE_PNG_COMPRESSION, OUTPUT_PNG_COMPRESSION])
+            print(f"Визуализация сохранена: {OUTPUT_IMAGE_PATH}")
         
         print("\nГотово!")
         
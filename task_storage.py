@@ -0,0 +1,228 @@
+"""
+Хранилище задач анализа и индекса загруженных видео на SQLite
+Общее для всех воркеров Uvicorn: задача видна из любого процесса API
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from enum import Enum
+from typing import Dict, Iterable, List, Optional
+
+# ============================================================================
+# КОНФИГУРАЦИЯ
+# ============================================================================
+
+TASKS_DB_PATH = os.getenv("TASKS_DB_PATH", "tasks.db")
+
+# Через сколько секунд без heartbeat процесс API считается остановленным,
+# а его незавершенные задачи - брошенными
+WORKER_TIMEOUT = 30.0
+
+# Поля задачи в порядке колонок таблицы
+TASK_FIELDS = (
+    "task_id",
+    "status",
+    "video_id",
+    "created_at",
+    "completed_at",
+    "error",
+    "statistics",
+    "visualization_path",
+    "zones",
+    "worker_id",
+)
+
+# Поля, которые хранятся в колонках как JSON
+JSON_FIELDS = ("statistics", "zones")
+
+
+class TaskStorage:
+    """Хранилище задач (таблица tasks) и путей к загруженным видео (таблица videos)."""
+
+    def __init__(self, db_path: str = TASKS_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    video_id TEXT,
+                    created_at TEXT NOT NULL,
+                    completed_at TEXT,
+                    error TEXT,
+                    statistics TEXT,
+                    visualization_path TEXT,
+                    zones TEXT,
+                    worker_id TEXT
+                )
+                """
+            )
+            # Колонки, добавленные после первой версии таблицы
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(tasks)")}
+            for column in ("zones", "worker_id"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE tasks ADD COLUMN {column} TEXT")
+            # Индексы для постраничного списка задач (в том числе с фильтром по статусу)
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_created_at ON tasks (created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_status_created_at ON tasks (status, created_at)")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS videos (
+                    video_id TEXT PRIMARY KEY,
+                    path TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS workers (
+                    worker_id TEXT PRIMARY KEY,
+                    heartbeat_at REAL NOT NULL
+                )
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока (sqlite3 не разделяет их между потоками)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            # WAL позволяет читать задачи, пока другой процесс их обновляет
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_db(field: str, value):
+        """Конвертирует значение поля в формат колонки."""
+        if value is None:
+            return None
+        if field in JSON_FIELDS:
+            return json.dumps(value, ensure_ascii=False)
+        if isinstance(value, Enum):
+            return value.value
+        return value
+
+    @staticmethod
+    def _from_db(row: sqlite3.Row) -> Dict:
+        """Конвертирует строку таблицы в словарь задачи."""
+        task = dict(row)
+        for field in JSON_FIELDS:
+            if task[field] is not None:
+                task[field] = json.loads(task[field])
+        return task
+
+    def create(self, task: Dict):
+        """Сохраняет новую задачу."""
+        values = [self._to_db(field, task.get(field)) for field in TASK_FIELDS]
+        placeholders = ", ".join("?" for _ in TASK_FIELDS)
+        with self._connect() as conn:
+            conn.execute(f"INSERT INTO tasks ({', '.join(TASK_FIELDS)}) VALUES ({placeholders})", values)
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        """Возвращает задачу или None, если она не найдена."""
+        row = self._connect().execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return self._from_db(row) if row is not None else None
+
+    def update(self, task_id: str, **fields):
+        """Обновляет поля задачи."""
+        for field in fields:
+            if field not in TASK_FIELDS or field == "task_id":
+                raise ValueError(f"Неизвестное поле задачи: {field}")
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        values = [self._to_db(field, value) for field, value in fields.items()]
+        with self._connect() as conn:
+            conn.execute(f"UPDATE tasks SET {assignments} WHERE task_id = ?", (*values, task_id))
+
+    def delete(self, task_id: str) -> bool:
+        """Удаляет задачу. Возвращает False, если задачи не было."""
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+        return cursor.rowcount > 0
+
+    def list_tasks(self, limit: int, offset: int = 0, status: Optional[str] = None) -> List[Dict]:
+        """Возвращает страницу задач в порядке создания (опционально только с указанным статусом)."""
+        if status is None:
+            rows = self._connect().execute(
+                "SELECT * FROM tasks ORDER BY created_at LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        else:
+            rows = self._connect().execute(
+                "SELECT * FROM tasks WHERE status = ? ORDER BY created_at LIMIT ? OFFSET ?",
+                (self._to_db("status", status), limit, offset)
+            ).fetchall()
+        return [self._from_db(row) for row in rows]
+
+    def count(self, status: Optional[str] = None) -> int:
+        """Возвращает количество задач (опционально только с указанным статусом)."""
+        if status is None:
+            return self._connect().execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM tasks WHERE status = ?", (self._to_db("status", status),)
+        ).fetchone()[0]
+
+    def add_video(self, video_id: str, path: str):
+        """Запоминает путь к загруженному видео."""
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO videos (video_id, path) VALUES (?, ?)", (video_id, path))
+
+    def get_video_path(self, video_id: str) -> Optional[str]:
+        """Возвращает путь к видео или None, если видео не загружено."""
+        row = self._connect().execute("SELECT path FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+        return row["path"] if row is not None else None
+
+    def delete_video(self, video_id: str) -> bool:
+        """Удаляет видео из индекса. Возвращает False, если его не было."""
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM videos WHERE video_id = ?", (video_id,))
+        return cursor.rowcount > 0
+
+    def heartbeat(self, worker_id: str):
+        """Отмечает, что процесс API жив, и удаляет записи давно остановленных процессов."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO workers (worker_id, heartbeat_at) VALUES (?, ?)", (worker_id, now))
+            conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (now - 10 * WORKER_TIMEOUT,))
+
+    def claim_orphaned_tasks(self, worker_id: str, statuses: Iterable[str]) -> List[Dict]:
+        """
+        Забирает незавершенные задачи остановленных процессов API.
+
+        Задача считается брошенной, если у ее владельца нет свежего heartbeat.
+        Выборка и смена владельца идут в одной транзакции с блокировкой записи,
+        поэтому одну задачу не заберут два процесса.
+
+        Args:
+            worker_id: идентификатор текущего процесса
+            statuses: статусы незавершенных задач
+
+        Returns:
+            Список забранных задач
+        """
+        statuses = [self._to_db("status", status) for status in statuses]
+        placeholders = ", ".join("?" for _ in statuses)
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                f"""
+                SELECT * FROM tasks
+                WHERE status IN ({placeholders})
+                  AND (worker_id IS NULL
+                       OR worker_id NOT IN (SELECT worker_id FROM workers WHERE heartbeat_at >= ?))
+                ORDER BY created_at
+                """,
+                (*statuses, time.time() - WORKER_TIMEOUT)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET worker_id = ? WHERE task_id = ?",
+                [(worker_id, row["task_id"]) for row in rows]
+            )
+        return [dict(self._from_db(row), worker_id=worker_id) for row in rows]